@@ -6,14 +6,14 @@ __license__ = "GPL v3"
 __copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
 __docformat__ = "restructuredtext cs"
 
-import re
+import os
 import time
+from contextlib import contextmanager
 from queue import Empty, Queue
-from urllib.parse import quote
+from threading import Event
 
 from calibre.ebooks.metadata import check_isbn
 from calibre.ebooks.metadata.sources.base import Source
-from html5_parser import parse
 
 
 class DatabazeKnihCZ(Source):
@@ -33,14 +33,13 @@ class DatabazeKnihCZ(Source):
          "identifier:databazeknih", "identifier:isbn"])
 
     has_html_comments = True
-    supports_gzip_transfer_encoding = False
+    supports_gzip_transfer_encoding = True
     can_get_multiple_covers = False
     cached_cover_url_is_reliable = True
     prefer_results_with_isbn = False
 
     ID_NAME = "databazeknih"
     BASE_URL = "https://www.databazeknih.cz/"
-    GOOGLE_BASE_URL = "https://www.google.cz/search?q=site:databazeknih.cz/knihy%20"
 
     def config_widget(self):
         """
@@ -56,130 +55,519 @@ class DatabazeKnihCZ(Source):
         self.cfg_parse_rating = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_PARSE_RATING, True)
         self.cfg_add_databazeknih_id = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_ADD_DATABAZEKNIH_ID, True)
         self.cfg_verbose_loging = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_VERBOSE_LOGGING, True)
+        self.cfg_cache_ttl = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_CACHE_TTL, 30)
+        self.cfg_cache_size = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_CACHE_SIZE, 200)
+        self.cfg_cover_cache_size = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_COVER_CACHE_SIZE, 200)
+        self.cfg_stream_parse = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_STREAM_PARSE, True)
+        self.cfg_max_workers = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_MAX_WORKERS, 4)
+        self.cfg_max_candidates = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_MAX_CANDIDATES, 3)
+        self.cfg_search_backend = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_SEARCH_BACKEND, "google")
+        self.cfg_trace = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_TRACE, False)
+        self.cfg_keep_alive = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_KEEP_ALIVE, True)
+        self.cfg_series_prefetch = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_SERIES_PREFETCH, False)
+        self.cfg_search_cache_ttl = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_SEARCH_CACHE_TTL, 30)
+        self.cfg_search_miss_ttl = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_SEARCH_MISS_TTL, 3)
+        self.cfg_author_prefetch = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_AUTHOR_PREFETCH, False)
+        self.cfg_catalog = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_CATALOG, True)
+        self.cfg_hedge_search = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_HEDGE_SEARCH, False)
+        self.cfg_hedge_delay = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_HEDGE_DELAY, 0)
+        self.cfg_hedge_budget = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_HEDGE_BUDGET, 10)
+        self.cfg_parse_processes = cfg.plugin_prefs[cfg.STORE_NAME].get(cfg.KEY_PARSE_PROCESSES, 0)
+
+        from calibre_plugins.databazeknihcz.tracing import get_tracer
+        get_tracer().enabled = self.cfg_trace or get_tracer().force
+
+        # Pooled connections do not go through a proxy, calibre's browser handles that
+        from urllib.request import getproxies
+        from calibre_plugins.databazeknihcz.transport import get_transport
+        get_transport().enabled = self.cfg_keep_alive and not getproxies()
+
+        from calibre_plugins.databazeknihcz.parsepool import get_parse_pool
+        get_parse_pool().configure(self.cfg_parse_processes)
+
+    def cli_main(self, args):
+        """
+        calibre-debug -r DatabazeKnihCZ -- <command> [options]
+        """
+        from calibre_plugins.databazeknihcz.cli import main
+        self.load_config()
+        raise SystemExit(main(self, args[1:]))
 
     def is_customizable(self):
         """
         """
         return True
 
-    def identify(self, log, result_queue, abort, title=None, authors=None, identifiers=None, timeout=30):
+    def identify(self, log, result_queue, abort, title=None, authors=None, identifiers=None, timeout=30, plan=None):
         """
         Note this method will retry without identifiers automatically if no match is found with identifiers.
+        Only fields of plan are fetched, by default the plan follows the plugin config and calibre's ignored fields.
+        Return None, or the reason why a lookup without results did not finish (rate limit, time budget, abort),
+        so it is not taken for a book missing on DK.
         """
+        from calibre_plugins.databazeknihcz.cache import get_search_cache, search_key
+        from calibre_plugins.databazeknihcz.deadline import Cancelled, Deadline
+        from calibre_plugins.databazeknihcz.fetchplan import fetch_plan
+        from calibre_plugins.databazeknihcz.ratelimit import get_rate_limiter
+        from calibre_plugins.databazeknihcz.search import Candidate, rank
+        from calibre_plugins.databazeknihcz.singleflight import get_single_flight
+        from calibre_plugins.databazeknihcz.transport import get_transport
+
         if identifiers is None:
             identifiers = {}
         self.load_config()
+        # One budget for the whole lookup - search, book pages and more info fragments
+        deadline = Deadline(timeout, abort)
+        with self.traced_lookup("identify") as lookup_id:
+            throttled_before = get_rate_limiter().throttled_time()
+            transport_before = get_transport().stats()
 
-        # Create matches lists
-        matches = []
-        # Initialize browser object
-        br = self.browser
+            # Create matches lists
+            matches = []
+            # Initialize browser object
+            br = self.browser
 
-        book_id = identifiers.get("databazeknih", None)
-        log.info("Matching with DK ID: %s" % book_id)
-        if book_id:
-            databazeknih_url = DatabazeKnihCZ.BASE_URL + "knihy/" + book_id
-            log.info("Found DK URL: %s" % databazeknih_url)
-            matches.append(databazeknih_url)
-        else:
-            log.info("Google - matching with Title: %s & Author(s): %s" % (title, authors))
-            if title:
-                # Get matches for only title
-                search_title = title.replace(" ", "+").replace("-", "+")
-                google_url = "%s" % search_title
-                if title and authors:
-                    search_author = authors[0].replace(" ", "+")
-                    # Get matches for title + author
-                    google_url = "%s+%s" % (search_title, search_author)
-
-                # Remove multiple "+" from Google search query
-                google_url = quote(re.sub(r"\+{2,}", "+", google_url).encode("utf8"))
-                google_url = "%s%s" % (DatabazeKnihCZ.GOOGLE_BASE_URL, google_url)
-                log.info("Google search URL: %r" % google_url)
-                google_raw = br.open_novisit(google_url, timeout=timeout).read().strip()
-                google_root = parse(google_raw)
-                google_nodes = google_root.xpath("(//div[contains(@class, 'g')])//a/@href")
-
-                for url in google_nodes:
-                    if url != "#" and url.startswith("https://www.databazeknih.cz"):
-                        log.info("Found URL: %r" % url)
-                        matches.append(url)
-                        break
+            book_id = identifiers.get("databazeknih", None)
+            if not book_id:
+                # ISBN fast path - book parsed before, no search needed
+                book_id = self.isbn_to_databazeknih_id(identifiers.get("isbn", None))
+                if book_id:
+                    log.info("Found DK ID in ISBN index: %s" % book_id)
+            if plan is None:
+                # ISBN of a book resolved by its identifiers is not downloaded again
+                plan = fetch_plan(self, isbn=check_isbn(identifiers.get("isbn", None)) if book_id else None)
+            log.info("Fetch plan: %r" % plan)
+            cached_search = False
+            search_complete = True
+            # Books found by a local title lookup are still scored against the query
+            local_match = False
+            if not book_id and self.cfg_catalog and title:
+                # Book parsed before - no search needed
+                from calibre_plugins.databazeknihcz.catalog import get_catalog
+                entry = get_catalog().find(title, authors)
+                if entry:
+                    book_id, local_match = entry[0], True
+                    log.info("Found DK ID in local catalog: %s (score %.2f)" % entry)
+            if not book_id and self.cfg_series_prefetch and title:
+                # Volume of a series fetched before - no search needed
+                from calibre_plugins.databazeknihcz.series import get_series_index
+                book_id = get_series_index().find(title)
+                local_match = bool(book_id)
+                if book_id:
+                    log.info("Found DK ID in series index: %s" % book_id)
+            if not book_id and self.cfg_author_prefetch and title:
+                # Book of an author harvested before
+                from calibre_plugins.databazeknihcz.bibliography import get_bibliography
+                book_id = get_bibliography().find(title, authors)
+                local_match = bool(book_id)
+                if book_id:
+                    log.info("Found DK ID in author bibliography: %s" % book_id)
+            log.info("Matching with DK ID: %s" % book_id)
+            if book_id:
+                databazeknih_url = DatabazeKnihCZ.BASE_URL + "knihy/" + book_id
+                log.info("Found DK URL: %s" % databazeknih_url)
+                matches.append(Candidate(databazeknih_url, None, 1.0))
+            else:
+                log.info("Search - matching with Title: %s & Author(s): %s" % (title, authors))
+                search_cache = get_search_cache(self) if title else None
+                key = search_key(title, authors)
+                try:
+                    # Concurrent lookups of the same book search only once, other processes wait for the cache
+                    candidates, cached_search, search_complete = get_single_flight().run(
+                        "search:" + key,
+                        lambda: self.cached_search(log, br, title, authors, deadline, search_cache, key),
+                        deadline, shared=search_cache is not None)
+                except Cancelled:
+                    candidates, search_complete = [], False
+                if cached_search:
+                    log.info("Search outcome from cache: %d candidates" % len(candidates))
+                matches = rank(candidates, title, authors, self.cfg_max_candidates)
+
+            # Return if no Title
+            if deadline.expired():
+                return "Lookup stopped: %s" % deadline.reason()
+
+            # Report the matches
+            log.info("Matches are: ", matches)
+
+            # Setup worker tasks, candidates are submitted best first
+            from calibre_plugins.databazeknihcz.executor import get_executor, wait_all
+            from calibre_plugins.databazeknihcz.matching import CONFIDENCE
+            from calibre_plugins.databazeknihcz.worker import Worker
+            executor = get_executor(self.cfg_max_workers)
+            # Set by the first book that clears the confidence threshold, other candidates are not fetched then
+            found = Event()
+            query = (title, authors) if not book_id or local_match else None
+            workers = [Worker(c.url, result_queue, br, log, round(1 - c.score, 3), self, executor, query=query,
+                              found=found, lookup=lookup_id, deadline=deadline, plan=plan) for c in matches]
+
+            # Start working, the rate limiter takes care of request spacing.
+            # A confident first candidate is tried alone, the others only when it does not match.
+            first = workers[:1] if matches and matches[0].score >= CONFIDENCE else workers
+            wait_all([executor.submit(w.run) for w in first], abort, deadline)
+            rest = workers[len(first):]
+            if rest and not found.is_set() and not deadline.expired():
+                wait_all([executor.submit(w.run) for w in rest], abort, deadline)
+
+            if cached_search and matches and result_queue.empty() and not deadline.expired():
+                # Cached candidates lead nowhere (book removed from DK), search again next time
+                log.info("Cached search outcome is stale, dropping it")
+                search_cache.invalidate(key)
+
+            throttled = get_rate_limiter().throttled_time() - throttled_before
+            if throttled:
+                log.info("Time spent throttled by rate limiter: %.2f s" % throttled)
+            stats = get_transport().stats()
+            if stats["opened"] > transport_before["opened"] or stats["reused"] > transport_before["reused"]:
+                log.info("Connections opened: %d, reused: %d, transferred %.0f KB of %.0f KB" % (
+                    stats["opened"] - transport_before["opened"], stats["reused"] - transport_before["reused"],
+                    (stats["wire_bytes"] - transport_before["wire_bytes"]) / 1024.0,
+                    (stats["body_bytes"] - transport_before["body_bytes"]) / 1024.0))
+
+            if result_queue.empty():
+                failed = [w.url for w in workers if w.failed]
+                if deadline.expired():
+                    return "Lookup stopped: %s" % deadline.reason()
+                if failed:
+                    return "DK book pages not fetched: %s" % ", ".join(failed)
+                if not search_complete:
+                    return "Search inconclusive, a search provider failed or was skipped"
+            return None
+
+    def cached_search(self, log, br, title, authors, deadline, search_cache, key):
+        """
+        Candidates from the search cache or the search providers, whether they come from the cache
+        and whether the search is conclusive
+        """
+        candidates = search_cache.get(key) if search_cache is not None else None
+        if candidates is not None:
+            return candidates, True, True
+        candidates, complete = self.search_candidates(log, br, title, authors, deadline)
+        # Failed or cancelled searches are not remembered as misses
+        if search_cache is not None and (candidates or complete):
+            search_cache.put(key, candidates)
+        return candidates, False, complete
+
+    def search_candidates(self, log, br, title, authors, deadline):
+        """
+        Candidates from the first search provider that finds something and whether the search is conclusive
+        (all providers answered), an inconclusive miss is not cached
+        """
+        from calibre_plugins.databazeknihcz.breaker import get_circuit_breakers
+        from calibre_plugins.databazeknihcz.deadline import Cancelled
+        from calibre_plugins.databazeknihcz.search import search_providers
+
+        breakers = get_circuit_breakers()
+        providers = []
+        complete = True
+        for provider in search_providers(self.cfg_search_backend):
+            blocked = breakers.blocked(provider.name)
+            if blocked:
+                # Provider refused queries repeatedly, the next one is used until the cooldown ends
+                log.info("Search %s skipped for another %.0f s" % (provider.name, blocked))
+                complete = False
+            else:
+                providers.append(provider)
+        try:
+            if self.cfg_hedge_search and len(providers) > 1:
+                candidates, answered, tried = self.hedged_search(log, br, providers[0], providers[1], title, authors,
+                                                                 deadline)
+                if candidates:
+                    return candidates, True
+                complete = complete and answered
+                providers = providers[tried:]
+            for provider in providers:
+                if deadline.expired():
+                    return [], False
+                candidates = self.provider_search(log, br, provider, title, authors, deadline)
+                if candidates is None:
+                    complete = False
+                elif candidates:
+                    return candidates, True
+        except Cancelled:
+            return [], False
+        return [], complete
+
+    def provider_search(self, log, br, provider, title, authors, deadline):
+        """
+        Candidates found by one provider, None when it failed or its circuit breaker skipped it. Refusals count
+        towards its circuit breaker.
+        """
+        from calibre_plugins.databazeknihcz.breaker import get_circuit_breakers, trips
+        from calibre_plugins.databazeknihcz.deadline import Cancelled
+        from calibre_plugins.databazeknihcz.hedging import get_hedger
+        from calibre_plugins.databazeknihcz.ratelimit import RateLimited
+        from calibre_plugins.databazeknihcz.tracing import get_tracer
+
+        breakers = get_circuit_breakers()
+        # Only the caller actually sending a request after the cooldown holds the trial
+        blocked = breakers.claim(provider.name)
+        if blocked:
+            log.info("Search %s skipped for another %.0f s" % (provider.name, blocked))
+            return None
+        start = time.time()
+        try:
+            with get_tracer().span("search", provider=provider.name) as attrs:
+                # Search, book page and more info share the budget
+                candidates = provider.search(br, log, title, authors, timeout=deadline.timeout(3), deadline=deadline)
+                attrs["candidates"] = len(candidates or [])
+        except RateLimited as e:
+            log.error("Search %s skipped: %s" % (provider.name, e))
+            return None
+        except Cancelled as e:
+            log.info("Search %s stopped: %s" % (provider.name, e))
+            raise
+        except Exception as e:
+            if trips(e):
+                log.error("Search %s refused: %s" % (provider.name, e))
+                cooldown = breakers.failure(provider.name)
+                if cooldown:
+                    log.error("Search %s disabled for %.0f s" % (provider.name, cooldown))
+            else:
+                log.exception("Search %s failed" % provider.name)
+            return None
+        breakers.success(provider.name)
+        get_hedger().observe(provider.name, time.time() - start)
+        if candidates:
+            log.info("Found %d candidates (%s)" % (len(candidates), provider.name))
+        return candidates or []
+
+    def hedged_search(self, log, br, primary, secondary, title, authors, deadline):
+        """
+        Search primary, and secondary too when primary has not answered within the hedge delay. The first
+        non-empty candidate list wins, the other search is cancelled.
+        Return (candidates, whether all started searches answered, number of providers tried).
+        """
+        from concurrent.futures import FIRST_COMPLETED, wait
+        from calibre_plugins.databazeknihcz.deadline import Cancelled
+        from calibre_plugins.databazeknihcz.executor import ABORT_CHECK_INTERVAL
+        from calibre_plugins.databazeknihcz.hedging import get_hedger
+        from calibre_plugins.databazeknihcz.tracing import get_tracer
+
+        hedger = get_hedger()
+        hedger.started()
+        lookup = get_tracer().current_lookup()
+        deadlines = {}
+
+        def search(provider, child):
+            with get_tracer().lookup(lookup):
+                return self.provider_search(log, br, provider, title, authors, child)
+
+        def start(provider):
+            child = deadline.child()
+            future = hedger.submit(search, provider, child)
+            deadlines[future] = child
+            return future
+
+        futures = [start(primary)]
+        delay = hedger.delay(primary.name, self.cfg_hedge_delay)
+        done, pending = wait(futures, timeout=min(delay, deadline.remaining()))
+        if pending and not deadline.expired() and hedger.allow(self.cfg_hedge_budget):
+            log.info("Search %s slower than %.1f s, asking %s too" % (primary.name, delay, secondary.name))
+            futures.append(start(secondary))
+        pending = set(futures)
+        answered = True
+        try:
+            while pending and not deadline.expired():
+                done, pending = wait(pending, timeout=ABORT_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        candidates = future.result()
+                    except Cancelled:
+                        candidates = None
+                    if candidates:
+                        return candidates, True, len(futures)
+                    answered = answered and candidates is not None
+        finally:
+            # Slower search is not needed any more, its connection is closed
+            for future in pending:
+                deadlines[future].cancel()
+        return [], answered and not pending, len(futures)
 
-        # Return if no Title
-        if abort.is_set():
+    @contextmanager
+    def traced_lookup(self, name):
+        """
+        Span covering a whole identify / download_cover call, spans of the lookup are written out at its end.
+        Nested calls (identify run by download_cover) belong to the outer lookup.
+        """
+        from calibre_plugins.databazeknihcz.tracing import append_jsonl, get_tracer, new_lookup_id, trace_dir
+        tracer = get_tracer()
+        outer = tracer.current_lookup()
+        lookup_id = outer or new_lookup_id()
+        try:
+            with tracer.lookup(lookup_id), tracer.span(name):
+                yield lookup_id
+        finally:
+            if tracer.enabled and not outer:
+                path = getattr(self, "trace_file", None) or os.path.join(trace_dir(), "trace-%d.jsonl" % os.getpid())
+                try:
+                    append_jsonl(path, tracer.take(lookup_id))
+                except:
+                    pass
+
+    def isbn_to_databazeknih_id(self, isbn):
+        """
+        DK id of a book parsed before, from the in-memory cache or the persistent ISBN index
+        """
+        isbn = check_isbn(isbn)
+        if not isbn:
+            return None
+        book_id = self.cached_isbn_to_identifier(isbn)
+        if book_id is None:
+            from calibre_plugins.databazeknihcz.isbnindex import get_isbn_index
+            book_id = get_isbn_index().get(isbn)
+            if book_id:
+                Source.cache_isbn_to_identifier(self, isbn, book_id)
+        return book_id
+
+    def cache_isbn_to_identifier(self, isbn, identifier):
+        """
+        Remember the mapping in memory and in the persistent ISBN index
+        """
+        from calibre_plugins.databazeknihcz.isbnindex import get_isbn_index
+        Source.cache_isbn_to_identifier(self, isbn, identifier)
+        get_isbn_index().put(isbn, identifier)
+
+    def cache_identifier_to_cover_url(self, id_, url):
+        """
+        Remember the cover url in memory and in the persistent cover store
+        """
+        from calibre_plugins.databazeknihcz.covers import get_cover_store
+        Source.cache_identifier_to_cover_url(self, id_, url)
+        get_cover_store(self).set_url(id_, url)
+
+    def catalog_book(self, mi, plan):
+        """
+        Add a parsed book to the local catalog index, with the optional fields its fetch plan parsed
+        """
+        if not self.cfg_catalog:
             return
+        from calibre_plugins.databazeknihcz.catalog import get_catalog
+        fields = {}
+        if plan.wants("series"):
+            fields["series"] = mi.series
+        if plan.wants("isbn") or plan.isbn:
+            fields["isbn"] = mi.isbn
+        get_catalog().put(mi.get_identifiers().get("databazeknih"), mi.title, mi.authors, **fields)
 
-        # Report the matches
-        log.info("Matches are: ", matches)
+    def refresh(self, log, result_queue, abort, identifiers=None, timeout=30):
+        """
+        Refresh metadata of a book identified before, see Worker.refresh. The result is emitted only
+        when the book changed. Return the changed fields, {} when nothing changed, None on failure
+        (no DK id or the page could not be fetched).
+        """
+        from calibre_plugins.databazeknihcz.deadline import Deadline
+        from calibre_plugins.databazeknihcz.fetchplan import fetch_plan
+        from calibre_plugins.databazeknihcz.worker import Worker
 
-        # Setup worker thread
+        self.load_config()
+        book_id = self.cover_identifier(identifiers or {})
+        if not book_id:
+            return None
+        deadline = Deadline(timeout, abort)
+        with self.traced_lookup("refresh") as lookup_id:
+            worker = Worker(DatabazeKnihCZ.BASE_URL + "knihy/" + book_id, result_queue, self.browser, log, 0, self,
+                            None, lookup=lookup_id, deadline=deadline, plan=fetch_plan(self))
+            try:
+                return worker.refresh()
+            except:
+                log.exception("Refresh failed for DK id: %s" % book_id)
+                return None
+
+    def resolve_cover_url(self, log, book_id, deadline):
+        """
+        Cover url from the DK page of book_id, streamed up to the cover image; the page gets half
+        of the budget, the image download the rest
+        """
+        from calibre_plugins.databazeknihcz.fetchplan import COVER_PLAN
+        from calibre_plugins.databazeknihcz.tracing import get_tracer
         from calibre_plugins.databazeknihcz.worker import Worker
-        workers = [Worker(url, result_queue, br, log, i, self) for i, url in enumerate(matches)]
-
-        # Start working
-        for w in workers:
-            w.start()
-            # Delay a little for every worker
-            time.sleep(1)
-
-        while not abort.is_set():
-            a_worker_is_alive = False
-            for w in workers:
-                w.join(0.2)
-                if abort.is_set():
-                    break
-                if w.is_alive():
-                    a_worker_is_alive = True
-            if not a_worker_is_alive:
-                break
-
-        return None
+        worker = Worker(DatabazeKnihCZ.BASE_URL + "knihy/" + book_id, None, self.browser, log, 0, self, None,
+                        deadline=deadline.child(deadline.remaining() / 2), plan=COVER_PLAN)
+        with get_tracer().span("resolve_cover"):
+            return worker.fetch_cover_url()
 
-    def get_cached_cover_url(self, identifiers):
+    def cover_identifier(self, identifiers):
         """
+        DK id for cover lookups, directly or through the ISBN index
         """
         book_id = identifiers.get("databazeknih", None)
         if book_id is None:
-            book_id = check_isbn(identifiers.get("isbn", None))
+            book_id = self.isbn_to_databazeknih_id(identifiers.get("isbn", None))
+        return book_id
+
+    def get_cached_cover_url(self, identifiers):
+        """
+        """
+        book_id = self.cover_identifier(identifiers)
+        if book_id is None:
+            return None
 
         url = self.cached_identifier_to_cover_url(book_id)
+        if url is None:
+            from calibre_plugins.databazeknihcz.covers import get_cover_store
+            self.load_config()
+            url = get_cover_store(self).url(book_id)
+            if url:
+                Source.cache_identifier_to_cover_url(self, book_id, url)
         return url
 
     def download_cover(self, log, result_queue, abort, title=None, authors=None, identifiers=None, timeout=30):
         """
         """
+        from calibre_plugins.databazeknihcz.covers import get_cover_store
+        from calibre_plugins.databazeknihcz.deadline import Cancelled, Deadline
+        from calibre_plugins.databazeknihcz.fetchplan import COVER_PLAN
+
         if identifiers is None:
             identifiers = {}
-        cached_url = self.get_cached_cover_url(identifiers)
+        self.load_config()
+        deadline = Deadline(timeout, abort)
+        with self.traced_lookup("download_cover"):
+            book_id = self.cover_identifier(identifiers)
+            cached_url = self.get_cached_cover_url(identifiers)
 
-        if not cached_url:
-            log.info("No cached cover found, running identify")
-            rq = Queue()
-            self.identify(log, rq, abort, title=title, authors=authors, identifiers=identifiers)
-            if abort.is_set():
+            if not cached_url and book_id:
+                # Book already identified - its page is read only up to the cover image
+                log.info("No cached cover found, reading cover url of: %s" % book_id)
+                cached_url = self.resolve_cover_url(log, book_id, deadline)
+                if deadline.expired():
+                    return
+            if not cached_url:
+                log.info("No cached cover found, running identify")
+                rq = Queue()
+                # Identify makes three requests in a row, the cover download is the fourth
+                # Only the cover url is needed - no more info request, the page is read up to the cover
+                self.identify(log, rq, abort, title=title, authors=authors, identifiers=identifiers,
+                              timeout=deadline.remaining() * 3 / 4, plan=COVER_PLAN)
+                if deadline.expired():
+                    return
+                results = []
+                while True:
+                    try:
+                        results.append(rq.get_nowait())
+                    except Empty:
+                        break
+                results.sort(key=self.identify_results_keygen(title=title, authors=authors, identifiers=identifiers))
+                for mi in results:
+                    cached_url = self.get_cached_cover_url(mi.identifiers)
+                    if cached_url:
+                        book_id = self.cover_identifier(mi.identifiers)
+                        break
+            if cached_url is None:
+                log.info("No cover found")
                 return
-            results = []
-            while True:
-                try:
-                    results.append(rq.get_nowait())
-                except Empty:
-                    break
-            results.sort(key=self.identify_results_keygen(title=title, authors=authors, identifiers=identifiers))
-            for mi in results:
-                cached_url = self.get_cached_cover_url(mi.identifiers)
-                if cached_url:
-                    break
-        if cached_url is None:
-            log.info("No cover found")
-            return
 
-        if abort.is_set():
-            return
-        br = self.browser
-        log.info("Downloading cover from:", cached_url)
-        try:
-            cdata = br.open_novisit(cached_url, timeout=timeout).read()
-            result_queue.put((self, cdata))
-        except:
-            log.exception("Failed to download cover from:", cached_url)
+            if deadline.expired():
+                return
+            br = self.browser
+            log.info("Downloading cover from:", cached_url)
+            try:
+                cdata = get_cover_store(self).download(br, log, book_id, cached_url, timeout=timeout,
+                                                       deadline=deadline)
+                if cdata:
+                    result_queue.put((self, cdata))
+            except Cancelled as e:
+                log.info("Cover download stopped: %s" % e)
+            except:
+                log.exception("Failed to download cover from:", cached_url)
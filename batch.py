@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from queue import Empty, Queue
+from threading import Event
+
+from calibre.utils.logging import ThreadSafeLog
+
+from calibre_plugins.databazeknihcz.hedging import get_hedger
+from calibre_plugins.databazeknihcz.singleflight import get_single_flight
+from calibre_plugins.databazeknihcz.tracing import format_summary, get_tracer, read_jsonl as read_spans, summary
+from calibre_plugins.databazeknihcz.transport import get_transport
+from calibre_plugins.databazeknihcz.worker import metadata_to_dict
+
+# Separators of the CSV input, same as in calibre's own CSV catalog
+AUTHORS_SEPARATOR = "&"
+IDENTIFIERS_SEPARATOR = ","
+
+
+def record_key(record):
+    """
+    Stable key of an input record, used in the checkpoint file
+    """
+    if record.get("id"):
+        return str(record["id"])
+    data = json.dumps([record.get("title"), record.get("authors"), record.get("identifiers")], sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def read_csv(path):
+    """
+    Columns id, title, authors (separated by "&"), identifiers ("isbn:123,databazeknih:abc-1")
+    """
+    with io.open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            authors = [a.strip() for a in (row.get("authors") or "").split(AUTHORS_SEPARATOR) if a.strip()]
+            identifiers = {}
+            for item in (row.get("identifiers") or "").split(IDENTIFIERS_SEPARATOR):
+                if ":" in item:
+                    name, value = item.split(":", 1)
+                    identifiers[name.strip()] = value.strip()
+            yield {"id": row.get("id"), "title": row.get("title"), "authors": authors, "identifiers": identifiers}
+
+
+def read_jsonl(path):
+    """
+    One object per line with keys id, title, authors (list) and identifiers (dict)
+    """
+    with io.open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                # Missing keys and nulls alike
+                record["authors"] = record.get("authors") or []
+                record["identifiers"] = record.get("identifiers") or {}
+                yield record
+
+
+def read_records(path):
+    """
+    """
+    if path.lower().endswith(".csv"):
+        return list(read_csv(path))
+    return list(read_jsonl(path))
+
+
+def read_checkpoint(path):
+    """
+    Keys of records finished by previous runs
+    """
+    if not os.path.exists(path):
+        return set()
+    with io.open(path, "r", encoding="utf-8") as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+def queue_items(queue):
+    """
+    """
+    items = []
+    while True:
+        try:
+            items.append(queue.get_nowait())
+        except Empty:
+            return items
+
+
+class Progress(object):
+    """
+    Live throughput / ETA line on stderr
+    """
+
+    def __init__(self, total, stream=sys.stderr):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.start = time.time()
+        self.stream = stream
+
+    def update(self, failed=False):
+        """
+        """
+        self.done += 1
+        self.failed += int(failed)
+        elapsed = time.time() - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        self.stream.write("\r%d/%d done, %d failed, %.2f books/s, ETA %s   " % (
+            self.done, self.total, self.failed, rate, time.strftime("%H:%M:%S", time.gmtime(eta))))
+        self.stream.flush()
+
+    def finish(self):
+        """
+        """
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+class BatchRunner(object):
+    """
+    Runs identify (and optionally download_cover) for many records on a bounded pool,
+    streams results to JSONL and keeps a checkpoint of finished records
+    """
+
+    def __init__(self, plugin, opts, log):
+        self.plugin = plugin
+        self.opts = opts
+        self.log = log
+        self.abort = Event()
+
+    def identify(self, record):
+        """
+        Process one record, return output line as dict
+        """
+        title, authors = record.get("title"), record.get("authors") or []
+        identifiers = record.get("identifiers") or {}
+        result = {"key": record_key(record), "input": record, "results": []}
+        if self.opts.refresh and identifiers.get("databazeknih"):
+            return self.refresh(record, result)
+        rq = Queue()
+        error = self.plugin.identify(self.log, rq, self.abort, title=title, authors=authors,
+                                     identifiers=dict(identifiers), timeout=self.opts.timeout)
+        results = queue_items(rq)
+        if error and not results:
+            # Lookup did not finish (rate limit, time budget, abort), the record is not checkpointed
+            raise RuntimeError(error)
+        results.sort(key=self.plugin.identify_results_keygen(title=title, authors=authors, identifiers=identifiers))
+        result["results"] = [metadata_to_dict(mi) for mi in results]
+
+        if self.opts.covers and results and not self.abort.is_set():
+            cq = Queue()
+            self.plugin.download_cover(self.log, cq, self.abort, title=title, authors=authors,
+                                       identifiers=dict(results[0].identifiers), timeout=self.opts.timeout)
+            covers = queue_items(cq)
+            if covers:
+                path = os.path.join(self.opts.covers, "%s.jpg" % result["key"])
+                with io.open(path, "wb") as f:
+                    f.write(covers[0][1])
+                result["cover"] = path
+        return result
+
+    def refresh(self, record, result):
+        """
+        Refresh a record with a DK id, only changed books have results
+        """
+        rq = Queue()
+        changed = self.plugin.refresh(self.log, rq, self.abort, identifiers=dict(record.get("identifiers") or {}),
+                                      timeout=self.opts.timeout)
+        if changed is None:
+            raise RuntimeError("Book page not fetched")
+        result["changed"] = changed
+        result["results"] = [metadata_to_dict(mi) for mi in queue_items(rq)]
+        return result
+
+    def run(self, records):
+        """
+        """
+        done = read_checkpoint(self.opts.checkpoint)
+        todo = [r for r in records if record_key(r) not in done]
+        print("%d records, %d already done, %d to go" % (len(records), len(records) - len(todo), len(todo)),
+              file=sys.stderr)
+        if self.opts.covers and not os.path.isdir(self.opts.covers):
+            os.makedirs(self.opts.covers)
+
+        progress = Progress(len(todo))
+        failed = 0
+        refreshed = changed = 0
+        with io.open(self.opts.output, "a", encoding="utf-8") as output, \
+                io.open(self.opts.checkpoint, "a", encoding="utf-8") as checkpoint, \
+                ThreadPoolExecutor(max_workers=self.opts.jobs) as executor:
+            pending = {}
+            records = iter(todo)
+            try:
+                while True:
+                    # Keep the pool busy without queueing all records up front
+                    while len(pending) < self.opts.jobs * 2 and not self.abort.is_set():
+                        record = next(records, None)
+                        if record is None:
+                            break
+                        pending[executor.submit(self.identify, record)] = record
+                    if not pending:
+                        break
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record = pending.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            self.log.exception("Record %s failed" % record_key(record))
+                            result = {"key": record_key(record), "input": record, "error": str(e)}
+                        ok = "error" not in result
+                        failed += int(not ok)
+                        if "changed" in result:
+                            refreshed += 1
+                            changed += int(bool(result["changed"]))
+                        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        output.flush()
+                        if ok:
+                            checkpoint.write(result["key"] + "\n")
+                            checkpoint.flush()
+                        progress.update(failed=not ok)
+            except KeyboardInterrupt:
+                self.abort.set()
+                for future in pending:
+                    future.cancel()
+        progress.finish()
+        if refreshed:
+            print("%d books refreshed, %d changed" % (refreshed, changed), file=sys.stderr)
+        return 1 if failed or self.abort.is_set() else 0
+
+
+def add_arguments(parser):
+    """
+    """
+    parser.add_argument("input", help="Records to identify, .csv or .jsonl")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument("--checkpoint", default=None, help="Finished records, default <output>.checkpoint")
+    parser.add_argument("--jobs", type=int, default=4, help="Books identified at the same time")
+    parser.add_argument("--timeout", type=int, default=30, help="Timeout of one identify in seconds")
+    parser.add_argument("--covers", default=None, help="Also download covers into this directory")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Only refresh records with a DK id, report the fields that changed since the last refresh")
+    parser.add_argument("--verbose", action="store_true", help="Log everything the plugin logs")
+    parser.add_argument("--trace", default=None, help="Record timing spans to this JSONL file, print summary")
+
+
+def run(plugin, opts):
+    """
+    Headless batch identify, returns process exit code
+    """
+    opts.checkpoint = opts.checkpoint or opts.output + ".checkpoint"
+    log = ThreadSafeLog(level=ThreadSafeLog.DEBUG if opts.verbose else ThreadSafeLog.WARN)
+    if opts.trace:
+        get_tracer().force = True
+        plugin.trace_file = opts.trace
+    code = BatchRunner(plugin, opts, log).run(read_records(opts.input))
+    coalesced = get_single_flight().stats()
+    if coalesced["local"] or coalesced["shared"]:
+        print("Duplicate lookups coalesced: %d in this process, %d waited for another process" % (
+            coalesced["local"], coalesced["shared"]), file=sys.stderr)
+    hedged = get_hedger().stats()
+    if hedged["hedges"]:
+        print("Slow searches repeated with another provider: %d of %d" % (hedged["hedges"], hedged["searches"]),
+              file=sys.stderr)
+    stats = get_transport().stats()
+    if stats["opened"] or stats["reused"]:
+        print("Connections opened: %d, reused: %d, transferred %.1f MB of %.1f MB (compression)" % (
+            stats["opened"], stats["reused"], stats["wire_bytes"] / 1048576.0, stats["body_bytes"] / 1048576.0),
+            file=sys.stderr)
+    if opts.trace and os.path.exists(opts.trace):
+        print(format_summary(summary(read_spans([opts.trace]))), file=sys.stderr)
+    return code
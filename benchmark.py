@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import io
+import json
+import os
+import time
+import tracemalloc
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+
+from lxml import etree
+
+from calibre_plugins.databazeknihcz.bibliography import parse_author_page
+from calibre_plugins.databazeknihcz.net import CHUNK_SIZE
+from calibre_plugins.databazeknihcz.parsepool import ParsePool, parse_book_page
+from calibre_plugins.databazeknihcz.search import PROVIDERS
+from calibre_plugins.databazeknihcz.series import parse_series_page
+from calibre_plugins.databazeknihcz.worker import Worker, metadata_to_dict
+
+# Worker methods timed separately, fetch_record covers HTML parsing and field extraction
+TIMED_METHODS = [
+    "fetch_record", "parse_title", "parse_authors", "parse_series", "parse_comments", "parse_publisher",
+    "parse_pubdate", "parse_tags", "parse_rating", "parse_isbn", "parse_language", "parse_cover",
+]
+
+# Allowed slowdown against the baseline before the run fails
+TOLERANCE = 0.25
+
+
+class NullLog(object):
+    """
+    """
+
+    def info(self, *args, **kwargs):
+        pass
+
+    error = exception = debug = warn = info
+
+
+class OfflineBrowser(object):
+    """
+    """
+
+    def clone_browser(self):
+        return self
+
+
+class OfflinePlugin(object):
+    """
+    Stands in for DatabazeKnihCZ, nothing is cached or persisted
+    """
+    cfg_cache_ttl = 0
+    cfg_verbose_loging = False
+    cfg_series_prefetch = False
+    cfg_author_prefetch = False
+
+    def __init__(self, stream_parse=True):
+        self.cfg_stream_parse = stream_parse
+
+    def cache_isbn_to_identifier(self, isbn, identifier):
+        pass
+
+    def cache_identifier_to_cover_url(self, identifier, url):
+        pass
+
+    def catalog_book(self, mi, plan):
+        pass
+
+
+class MemoryCache(object):
+    """
+    Response cache of one benchmark case
+    """
+
+    def __init__(self):
+        self.bodies = {}
+
+    def get(self, url):
+        return self.bodies.get(url)
+
+    def put(self, url, body):
+        self.bodies[url] = body
+
+    def invalidate(self, url):
+        self.bodies.pop(url, None)
+
+
+class InlineExecutor(object):
+    """
+    """
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class OfflineWorker(Worker):
+    """
+    Worker reading the book page and more info fragment from the corpus
+    """
+
+    def __init__(self, url, page, more_info, result_queue, stream_parse=True, cache=None):
+        Worker.__init__(self, url, result_queue, OfflineBrowser(), NullLog(), 0, OfflinePlugin(stream_parse),
+                        InlineExecutor())
+        self.cache = cache
+        self.chunk_size = CHUNK_SIZE
+        self.page = page
+        self.more_info_page = more_info
+        self.timings = {}
+        for name in TIMED_METHODS:
+            setattr(self, name, self.timed(name, getattr(self, name)))
+
+    def timed(self, name, method):
+        """
+        """
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return method(*args)
+            finally:
+                self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+        return wrapper
+
+    def fetch_record(self, url, markers=None):
+        """
+        Pages are not shared with other lookups, the shared single flight would claim them in the plugin storage
+        """
+        return self.load_record(url, markers)
+
+    def request(self, url):
+        """
+        """
+        if url == self.url:
+            return self.page
+        return self.more_info_page
+
+    def stream(self, url):
+        """
+        """
+        data = self.request(url) or b""
+        for i in range(0, len(data), self.chunk_size):
+            yield data[i:i + self.chunk_size]
+
+
+def comparable(mi):
+    """
+    Parsed Metadata view stored in the baseline - pubdate as the year DK gives (calibre fills in the rest from
+    the current date) and comments as plain text (calibre versions differ in the HTML around it)
+    """
+    data = metadata_to_dict(mi)
+    if data is not None:
+        data["pubdate"] = mi.pubdate.year if mi.pubdate else None
+        if mi.comments:
+            data["comments"] = " ".join(" ".join(etree.HTML(mi.comments).xpath("//text()")).split())
+    return data
+
+
+def read(corpus, name):
+    """
+    """
+    if not name:
+        return None
+    with io.open(os.path.join(corpus, name), "rb") as f:
+        return f.read()
+
+
+def run_book(case, corpus, stream_parse=True):
+    """
+    Parse one book page with its more info fragment, return parsed Metadata view and timings
+    """
+    queue = Queue()
+    worker = OfflineWorker(case["url"], read(corpus, case["page"]), read(corpus, case.get("more_info")), queue,
+                           stream_parse)
+    start = time.perf_counter()
+    worker.get_details()
+    total = time.perf_counter() - start
+    mi = queue.get_nowait() if not queue.empty() else None
+    return comparable(mi), total, worker.timings
+
+
+def run_cached_book(case, corpus, stream_parse=True):
+    """
+    Book page streamed only up to the cover first, then parsed whole from the same response cache -
+    the output has to be the same as of a book page parsed alone
+    """
+    page, more_info = read(corpus, case["page"]), read(corpus, case.get("more_info"))
+    cache = MemoryCache()
+    worker = OfflineWorker(case["url"], page, more_info, Queue(), cache=cache)
+    # Small chunks, so the corpus pages are cut short after the cover
+    worker.chunk_size = 256
+    worker.fetch_cover_url()
+    queue = Queue()
+    worker = OfflineWorker(case["url"], page, more_info, queue, False, cache)
+    start = time.perf_counter()
+    worker.get_details()
+    total = time.perf_counter() - start
+    mi = queue.get_nowait() if not queue.empty() else None
+    return comparable(mi), total, worker.timings
+
+
+def run_search(case, corpus, stream_parse=True):
+    """
+    """
+    raw = read(corpus, case["page"])
+    start = time.perf_counter()
+    candidates = PROVIDERS[case["provider"]]().parse(raw)
+    return [c.url for c in candidates], time.perf_counter() - start, {}
+
+
+def run_series_page(case, corpus, stream_parse=True):
+    """
+    """
+    raw = read(corpus, case["page"])
+    start = time.perf_counter()
+    name, volumes = parse_series_page(raw)
+    return [name] + [list(v) for v in volumes], time.perf_counter() - start, {}
+
+
+def run_author_page(case, corpus, stream_parse=True):
+    """
+    """
+    raw = read(corpus, case["page"])
+    start = time.perf_counter()
+    name, books = parse_author_page(raw)
+    return [name] + [list(book) for book in books], time.perf_counter() - start, {}
+
+
+def measure(run, case, corpus, repeat, stream_parse):
+    """
+    Run a case repeatedly, return output, pages/sec, mean per-field times and peak Python memory
+    """
+    tracemalloc.start()
+    output, total, fields = run(case, corpus, stream_parse)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    elapsed = 0.0
+    field_times = {}
+    for i in range(repeat):
+        output, total, fields = run(case, corpus, stream_parse)
+        elapsed += total
+        for name, value in fields.items():
+            field_times[name] = field_times.get(name, 0.0) + value
+    return {
+        "output": output,
+        "pages_per_sec": repeat / elapsed if elapsed else 0.0,
+        "field_ms": dict((name, 1000 * value / repeat) for name, value in sorted(field_times.items())),
+        "peak_kb": peak / 1024.0,
+    }
+
+
+def run_corpus(corpus, repeat, stream_parse=True):
+    """
+    """
+    with io.open(os.path.join(corpus, "corpus.json"), "rb") as f:
+        manifest = json.loads(f.read().decode("utf-8"))
+    results = {}
+    for case in manifest.get("books", []):
+        results[case["name"]] = measure(run_book, case, corpus, repeat, stream_parse)
+        results["cached_" + case["name"]] = measure(run_cached_book, case, corpus, repeat, stream_parse)
+    for case in manifest.get("searches", []):
+        results["search_" + case["name"]] = measure(run_search, case, corpus, repeat, stream_parse)
+    for case in manifest.get("series_pages", []):
+        results["series_" + case["name"]] = measure(run_series_page, case, corpus, repeat, stream_parse)
+    for case in manifest.get("author_pages", []):
+        results["author_" + case["name"]] = measure(run_author_page, case, corpus, repeat, stream_parse)
+    return results
+
+
+def run_parse_pool(corpus, repeat, processes):
+    """
+    Pages/sec of book pages parsed by as many concurrent lookups as there are processes, in the lookup threads
+    (pool off) and in a parse pool of that size. None for the pool when its processes cannot run plugin code.
+    """
+    with io.open(os.path.join(corpus, "corpus.json"), "rb") as f:
+        manifest = json.loads(f.read().decode("utf-8"))
+    pages = [read(corpus, case["page"]) for case in manifest.get("books", [])] * repeat
+    results = {}
+    for name, size in (("threads", 0), ("pool", processes)):
+        pool = ParsePool()
+        pool.configure(size)
+        if size:
+            # Processes are started outside of the measured time
+            pool.run(parse_book_page, pages[0])
+        with ThreadPoolExecutor(max_workers=processes) as lookups:
+            start = time.perf_counter()
+            list(lookups.map(lambda raw: pool.run(parse_book_page, raw), pages))
+            elapsed = time.perf_counter() - start
+        if pool.executor is not None:
+            pool.executor.shutdown()
+        results[name] = None if pool.broken else len(pages) / elapsed
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    List of regressions against baseline - changed output of expected fields or lower throughput
+    """
+    problems = []
+    for name, expected in baseline.get("expected", {}).items():
+        output = results.get(name, {}).get("output")
+        if isinstance(expected, dict) and isinstance(output, dict):
+            for key, value in expected.items():
+                if output.get(key) != value:
+                    problems.append("%s: %s is %r, expected %r" % (name, key, output.get(key), value))
+        elif output != expected:
+            problems.append("%s: output is %r, expected %r" % (name, output, expected))
+    for name, pages_per_sec in baseline.get("pages_per_sec", {}).items():
+        current = results.get(name, {}).get("pages_per_sec", 0.0)
+        if current < pages_per_sec * (1 - tolerance):
+            problems.append("%s: %.1f pages/sec, baseline %.1f" % (name, current, pages_per_sec))
+    return problems
+
+
+def report(results):
+    """
+    """
+    for name, result in sorted(results.items()):
+        print("%-28s %10.1f pages/sec %10.1f KB peak" % (name, result["pages_per_sec"], result["peak_kb"]))
+        for field, ms in result["field_ms"].items():
+            print("    %-24s %8.3f ms" % (field, ms))
+
+
+def add_arguments(parser):
+    """
+    """
+    parser.add_argument("--corpus", default="corpus", help="Directory with corpus.json and saved pages")
+    parser.add_argument("--baseline", default=None, help="Baseline file, default <corpus>/baseline.json")
+    parser.add_argument("--repeat", type=int, default=50, help="Runs of every page")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Allowed slowdown, 0.25 = 25 %%")
+    parser.add_argument("--full-parse", action="store_true", help="Parse whole pages instead of streaming")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--ci", action="store_true",
+                        help="Fail without a baseline, or for cases missing in its pages/sec figures if it has them")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Also compare parsing in a process pool of this size with parsing in threads")
+
+
+def run(plugin, opts):
+    """
+    Offline parser benchmark, returns process exit code
+    """
+    baseline_path = opts.baseline or os.path.join(opts.corpus, "baseline.json")
+    results = run_corpus(opts.corpus, opts.repeat, not opts.full_parse)
+    report(results)
+    if opts.processes > 0:
+        # Not compared with the baseline, the speedup depends on the machine's cores
+        speeds = run_parse_pool(opts.corpus, opts.repeat, opts.processes)
+        for name in ("threads", "pool"):
+            print("parse_%-22s %s" % (name, "%10.1f pages/sec" % speeds[name] if speeds[name] else "not available"))
+
+    if opts.save_baseline:
+        baseline = {
+            "expected": dict((name, result["output"]) for name, result in results.items()),
+            "pages_per_sec": dict((name, result["pages_per_sec"]) for name, result in results.items()),
+        }
+        with io.open(baseline_path, "wb") as f:
+            f.write(json.dumps(baseline, indent=4, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        print("Baseline saved to %s" % baseline_path)
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print("No baseline at %s, run with --save-baseline" % baseline_path)
+        return 1 if opts.ci else 0
+    with io.open(baseline_path, "rb") as f:
+        baseline = json.loads(f.read().decode("utf-8"))
+    problems = compare(results, baseline, opts.tolerance)
+    if opts.ci and not baseline.get("pages_per_sec"):
+        # Committed baseline has only the expected fields, the throughput depends on the machine
+        print("No pages/sec in %s, speed not checked - run --save-baseline on this machine" % baseline_path)
+    elif opts.ci:
+        # Throughput of a case added after the baseline was saved would never be checked
+        for name in sorted(set(results) - set(baseline["pages_per_sec"])):
+            problems.append("%s: no pages/sec in the baseline" % name)
+    for problem in problems:
+        print("REGRESSION %s" % problem)
+    return 1 if problems else 0
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import re
+
+from calibre_plugins.databazeknihcz.booklist import BookListIndex, page_url, parse_book_list
+from calibre_plugins.databazeknihcz.matching import fold, tokens
+from calibre_plugins.databazeknihcz.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS author_pages (
+    author_url TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    fetched REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS author_pages_name ON author_pages (name_key);
+CREATE TABLE IF NOT EXISTS author_books (
+    author_url TEXT NOT NULL,
+    databazeknih_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    folded_title TEXT NOT NULL,
+    PRIMARY KEY (author_url, databazeknih_id)
+);
+CREATE INDEX IF NOT EXISTS author_books_title ON author_books (folded_title);
+"""
+
+# Author pages are fetched again after this many seconds, new books appear on them
+AUTHOR_MAX_AGE = 30 * 24 * 3600
+
+AUTHOR_LINK = re.compile(r"^https?://www\.databazeknih\.cz/autori/[^/?#]+")
+
+
+def author_url(url):
+    """
+    Absolute DK author url or None for other links
+    """
+    return page_url(AUTHOR_LINK, url)
+
+
+def name_key(name):
+    """
+    Author name words in fixed order - "Martin, George R. R." and "George R. R. Martin" are the same author
+    """
+    return " ".join(sorted(tokens(name)))
+
+
+def parse_author_page(raw):
+    """
+    Author name and (DK id, title) of all books listed on a DK author page
+    """
+    name, books = parse_book_list(raw)
+    return name, [(databazeknih_id, title) for databazeknih_id, title, node in books]
+
+
+class Bibliography(BookListIndex):
+    """
+    Books of authors harvested from their DK pages - DK id of an author's title without searching
+    """
+    PAGES = "author_pages"
+    BOOKS = "author_books"
+    URL = "author_url"
+
+    def __init__(self, storage):
+        BookListIndex.__init__(self, storage, "bibliography", SCHEMA)
+
+    def page_values(self, name):
+        """
+        """
+        return {"name": name, "name_key": name_key(name)}
+
+    def book_values(self, book):
+        """
+        """
+        databazeknih_id, title = book
+        return {"databazeknih_id": databazeknih_id, "title": title, "folded_title": fold(title)}
+
+    def find(self, title, authors):
+        """
+        DK id of the only book with exactly this title (ignoring case and diacritics) by one of authors, or None
+        """
+        keys = [name_key(author) for author in authors or [] if author]
+        if not keys or not title:
+            return None
+        rows = self.storage.execute(
+            "SELECT DISTINCT b.databazeknih_id FROM author_books b JOIN author_pages p ON p.author_url = b.author_url "
+            "WHERE b.folded_title = ? AND p.name_key IN (%s)" % ", ".join("?" * len(keys)),
+            [fold(title)] + keys).fetchall()
+        return rows[0][0] if len(rows) == 1 else None
+
+
+def get_bibliography():
+    """
+    """
+    return Bibliography(get_storage())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import time
+from io import BytesIO
+from urllib.parse import urljoin
+
+from lxml import etree
+
+from calibre_plugins.databazeknihcz.search import BASE_URL, book_url
+
+NAME = etree.XPath("//h1/text()")
+# Listed books are in the page content, links elsewhere are recommendations
+CONTENT_BOOK_LINKS = etree.XPath("//*[@id='content']//a[contains(@href, 'knihy/')]")
+ALL_BOOK_LINKS = etree.XPath("//a[contains(@href, 'knihy/')]")
+
+
+def page_url(link, url):
+    """
+    Absolute url of a DK page matched by the link regex, None for other links
+    """
+    match = link.match(urljoin(BASE_URL, url))
+    return match.group(0) if match else None
+
+
+def parse_book_list(raw):
+    """
+    Heading of a DK page listing books (series, author) and (DK id, title, link node) of every listed book
+    in page order, each book once
+    """
+    root = etree.parse(BytesIO(raw), etree.HTMLParser())
+    name = "".join(NAME(root)).strip()
+    books = []
+    seen = set()
+    for node in CONTENT_BOOK_LINKS(root) or ALL_BOOK_LINKS(root):
+        url = book_url(node.get("href"))
+        title = node.xpath("string()").strip()
+        if not url or not title:
+            continue
+        databazeknih_id = url.rsplit("/", 1)[-1]
+        if databazeknih_id not in seen:
+            seen.add(databazeknih_id)
+            books.append((databazeknih_id, title, node))
+    return name, books
+
+
+def insert(table, values):
+    """
+    INSERT OR REPLACE statement for a row of values (column -> value)
+    """
+    return "INSERT OR REPLACE INTO %s (%s) VALUES (%s)" % (table, ", ".join(values), ", ".join("?" * len(values)))
+
+
+class BookListIndex(object):
+    """
+    Books listed on DK pages fetched before, stored per page. Subclasses name the tables (PAGES, BOOKS),
+    the url column (URL) and give the extra columns of a page (page_values) and of a book (book_values).
+    """
+    PAGES = None
+    BOOKS = None
+    URL = None
+
+    def __init__(self, storage, name, schema):
+        self.storage = storage
+        self.storage.ensure_schema(name, schema)
+
+    def fresh(self, url, max_age):
+        """
+        Was the page stored less than max_age seconds ago
+        """
+        row = self.storage.execute("SELECT fetched FROM %s WHERE %s = ?" % (self.PAGES, self.URL),
+                                   (url,)).fetchone()
+        return row is not None and time.time() - row[0] < max_age
+
+    def put(self, url, name, books):
+        """
+        Replace the stored books of the page at url
+        """
+        page = self.page_values(name)
+        page.update({self.URL: url, "fetched": time.time()})
+        rows = []
+        for book in books:
+            values = self.book_values(book)
+            values[self.URL] = url
+            rows.append(values)
+        with self.storage.transaction() as conn:
+            conn.execute(insert(self.PAGES, page), list(page.values()))
+            conn.execute("DELETE FROM %s WHERE %s = ?" % (self.BOOKS, self.URL), (url,))
+            if rows:
+                conn.executemany(insert(self.BOOKS, rows[0]), [list(values.values()) for values in rows])
+
+    def page_values(self, name):
+        """
+        """
+        return {"name": name}
+
+    def book_values(self, book):
+        """
+        """
+        raise NotImplementedError()
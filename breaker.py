@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import os
+import socket
+import time
+
+from calibre_plugins.databazeknihcz.net import THROTTLE_CODES, error_code
+from calibre_plugins.databazeknihcz.search import Blocked
+from calibre_plugins.databazeknihcz.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS circuit_breakers (
+    provider TEXT PRIMARY KEY,
+    failures INTEGER NOT NULL,
+    first_failure REAL NOT NULL,
+    open_until REAL NOT NULL,
+    opened INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS breaker_trials (
+    provider TEXT PRIMARY KEY,
+    owner INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+# Failures within WINDOW seconds that open the circuit
+THRESHOLD = 3
+WINDOW = 10 * 60
+# First cooldown, doubled every time the trial request after a cooldown fails
+COOLDOWN = 15 * 60
+MAX_COOLDOWN = 6 * 3600
+# Trial request claimed by a process, taken over after this long - the process may have died (seconds)
+TRIAL_LEASE = 60
+
+
+def trips(e):
+    """
+    Does the error mean the provider refuses us (429 / 503, captcha) or does not answer (timeout)
+    """
+    if isinstance(e, Blocked) or error_code(e) in THROTTLE_CODES:
+        return True
+    if isinstance(e, socket.timeout):
+        return True
+    reason = getattr(e, "reason", None)
+    args = getattr(e, "args", None) or [None]
+    return isinstance(reason, socket.timeout) or isinstance(args[0], socket.timeout)
+
+
+class CircuitBreakers(object):
+    """
+    Circuit breaker per search provider, shared by all calibre job processes through the plugin storage.
+    A provider that fails THRESHOLD times in a row is skipped for a cooldown, then one trial request decides
+    whether it is used again or skipped for twice as long. The trial is claimed in the storage, so only one
+    process (and thread) probes the provider while the others keep skipping it.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.storage.ensure_schema("circuit_breakers", SCHEMA)
+
+    def blocked(self, provider):
+        """
+        Seconds until the provider may be tried again, 0 when it may be used now (or its trial request sent).
+        Nothing is claimed, the caller about to send a request takes the trial with claim().
+        """
+        row = self.storage.execute("SELECT open_until, opened FROM circuit_breakers WHERE provider = ?",
+                                   (provider,)).fetchone()
+        now = time.time()
+        if row is None or not row[1] or now < row[0]:
+            return max(0.0, row[0] - now) if row else 0.0
+        row = self.storage.execute("SELECT expires FROM breaker_trials WHERE provider = ?", (provider,)).fetchone()
+        return max(0.0, row[0] - now) if row else 0.0
+
+    def claim(self, provider):
+        """
+        Like blocked(), but after the cooldown the caller getting 0 holds the trial request, it has to report
+        its outcome with failure() / success()
+        """
+        row = self.storage.execute("SELECT open_until, opened FROM circuit_breakers WHERE provider = ?",
+                                   (provider,)).fetchone()
+        now = time.time()
+        if row is None or not row[1] or now < row[0]:
+            return max(0.0, row[0] - now) if row else 0.0
+        with self.storage.transaction() as conn:
+            now = time.time()
+            row = conn.execute("SELECT expires FROM breaker_trials WHERE provider = ?", (provider,)).fetchone()
+            if row is not None and row[0] > now:
+                # Another caller is sending the trial request
+                return row[0] - now
+            conn.execute("INSERT OR REPLACE INTO breaker_trials (provider, owner, expires) VALUES (?, ?, ?)",
+                         (provider, os.getpid(), now + TRIAL_LEASE))
+        return 0.0
+
+    def failure(self, provider):
+        """
+        Record a failed request, return the cooldown in seconds if the circuit opened, otherwise 0
+        """
+        with self.storage.transaction() as conn:
+            now = time.time()
+            row = conn.execute("SELECT failures, first_failure, open_until, opened FROM circuit_breakers "
+                               "WHERE provider = ?", (provider,)).fetchone()
+            failures, first_failure, open_until, opened = row if row else (0, now, 0.0, 0)
+            if opened and now >= open_until:
+                # Trial request after the cooldown failed
+                failures = THRESHOLD
+            elif now - first_failure > WINDOW:
+                failures, first_failure = 1, now
+            else:
+                failures += 1
+            cooldown = 0
+            if failures >= THRESHOLD:
+                cooldown = min(MAX_COOLDOWN, COOLDOWN * 2 ** opened)
+                open_until, opened, failures = now + cooldown, opened + 1, 0
+            conn.execute("INSERT OR REPLACE INTO circuit_breakers (provider, failures, first_failure, open_until, "
+                         "opened) VALUES (?, ?, ?, ?, ?)", (provider, failures, first_failure, open_until, opened))
+            conn.execute("DELETE FROM breaker_trials WHERE provider = ?", (provider,))
+        return cooldown
+
+    def success(self, provider):
+        """
+        Provider answered, the circuit closes
+        """
+        with self.storage.transaction() as conn:
+            conn.execute("DELETE FROM circuit_breakers WHERE provider = ?", (provider,))
+            conn.execute("DELETE FROM breaker_trials WHERE provider = ?", (provider,))
+
+
+def get_circuit_breakers():
+    """
+    """
+    return CircuitBreakers(get_storage())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import json
+import time
+
+from calibre_plugins.databazeknihcz.matching import fold
+from calibre_plugins.databazeknihcz.search import Candidate
+from calibre_plugins.databazeknihcz.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_results (
+    query TEXT PRIMARY KEY,
+    candidates TEXT NOT NULL,
+    stored REAL NOT NULL
+);
+"""
+
+# Do not rewrite the access time of an entry more often than this (seconds)
+ACCESS_RESOLUTION = 60
+
+
+class ResponseCache(object):
+    """
+    Persistent cache of response bodies keyed by URL with TTL, size cap and LRU eviction
+    """
+
+    def __init__(self, storage, ttl, max_size):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_size = max_size
+        self.storage.ensure_schema("responses", SCHEMA)
+
+    def get(self, url):
+        """
+        Return cached body for url or None
+        """
+        now = time.time()
+        row = self.storage.execute("SELECT body, stored, accessed FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        body, stored, accessed = row
+        if now - stored > self.ttl:
+            return None
+        if now - accessed > ACCESS_RESOLUTION:
+            self.storage.execute("UPDATE responses SET accessed = ? WHERE url = ?", (now, url))
+        return bytes(body)
+
+    def put(self, url, body):
+        """
+        """
+        now = time.time()
+        size = len(body)
+        if size > self.max_size:
+            return
+        with self.storage.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses (url, body, size, stored, accessed) VALUES (?, ?, ?, ?, ?)",
+                         (url, memoryview(body), size, now, now))
+            self.evict(conn, now)
+
+    def evict(self, conn, now):
+        """
+        Drop expired entries and then the least recently used ones until the cache fits its size cap
+        """
+        conn.execute("DELETE FROM responses WHERE stored < ?", (now - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size:
+            return
+        over = total - self.max_size
+        urls = []
+        for url, size in conn.execute("SELECT url, size FROM responses ORDER BY accessed"):
+            urls.append((url,))
+            over -= size
+            if over <= 0:
+                break
+        conn.executemany("DELETE FROM responses WHERE url = ?", urls)
+
+    def invalidate(self, url):
+        """
+        """
+        self.storage.execute("DELETE FROM responses WHERE url = ?", (url,))
+
+
+def search_key(title, authors):
+    """
+    Search cache key - title and first author without case, diacritics and punctuation
+    """
+    return "%s|%s" % (fold(title), fold(authors[0]) if authors else "")
+
+
+class SearchCache(object):
+    """
+    Persistent search outcomes - candidate urls of found books and queries that found nothing,
+    misses expire sooner than hits
+    """
+
+    def __init__(self, storage, hit_ttl, miss_ttl):
+        self.storage = storage
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.storage.ensure_schema("search_results", SEARCH_SCHEMA)
+
+    def get(self, key):
+        """
+        Cached candidates for key, empty list for a known miss, None if the query has to be searched
+        """
+        row = self.storage.execute("SELECT candidates, stored FROM search_results WHERE query = ?",
+                                   (key,)).fetchone()
+        if row is None:
+            return None
+        candidates = [Candidate(url, text, 0.0) for url, text in json.loads(row[0])]
+        ttl = self.hit_ttl if candidates else self.miss_ttl
+        if time.time() - row[1] > ttl:
+            return None
+        return candidates
+
+    def put(self, key, candidates):
+        """
+        """
+        ttl = self.hit_ttl if candidates else self.miss_ttl
+        if not ttl:
+            return
+        now = time.time()
+        data = json.dumps([[c.url, c.text] for c in candidates], ensure_ascii=False)
+        with self.storage.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO search_results (query, candidates, stored) VALUES (?, ?, ?)",
+                         (key, data, now))
+            conn.execute("DELETE FROM search_results WHERE stored < ?", (now - max(self.hit_ttl, self.miss_ttl),))
+
+    def invalidate(self, key):
+        """
+        """
+        self.storage.execute("DELETE FROM search_results WHERE query = ?", (key,))
+
+
+def get_search_cache(plugin):
+    """
+    Search cache configured from plugin preferences, or None if it is disabled
+    """
+    if not plugin.cfg_search_cache_ttl and not plugin.cfg_search_miss_ttl:
+        return None
+    return SearchCache(get_storage(), plugin.cfg_search_cache_ttl * 24 * 3600, plugin.cfg_search_miss_ttl * 24 * 3600)
+
+
+def get_response_cache(plugin):
+    """
+    Response cache configured from plugin preferences, or None if caching is disabled
+    """
+    if not plugin.cfg_cache_ttl:
+        return None
+    return ResponseCache(get_storage(), plugin.cfg_cache_ttl * 24 * 3600, plugin.cfg_cache_size * 1024 * 1024)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import json
+import time
+
+from calibre_plugins.databazeknihcz.matching import CONFIDENCE, fold, metadata_score, tokens
+from calibre_plugins.databazeknihcz.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_books (
+    databazeknih_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    authors TEXT NOT NULL,
+    series TEXT,
+    isbn TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS catalog_terms (
+    term TEXT NOT NULL,
+    databazeknih_id TEXT NOT NULL,
+    PRIMARY KEY (term, databazeknih_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS catalog_terms_id ON catalog_terms (databazeknih_id);
+"""
+
+# Books with the most shared terms that are scored in full
+MAX_CANDIDATES = 20
+NGRAM = 3
+# Stored with a book, not used for matching
+OPTIONAL_FIELDS = ("series", "isbn")
+
+
+def ngrams(text, n=NGRAM):
+    """
+    Character n-grams of the folded text, words padded with spaces - tolerate typos and word form changes
+    """
+    result = set()
+    for word in fold(text).split():
+        word = " %s " % word
+        result.update(word[i:i + n] for i in range(max(1, len(word) - n + 1)))
+    return result
+
+
+def terms(title, authors):
+    """
+    Index terms of a book - words of title and authors and title n-grams, the same terms are queried
+    """
+    result = set("w:" + word for word in tokens(title))
+    for author in authors or []:
+        result.update("a:" + word for word in tokens(author))
+    result.update("g:" + gram for gram in ngrams(title))
+    return result
+
+
+class Catalog(object):
+    """
+    Inverted index of every DK book the plugin parsed, diacritics-insensitive.
+    Resolves title / authors to a DK id without searching.
+    """
+
+    def __init__(self, storage, threshold=CONFIDENCE):
+        self.storage = storage
+        self.threshold = threshold
+        self.storage.ensure_schema("catalog", SCHEMA)
+
+    def put(self, databazeknih_id, title, authors, **fields):
+        """
+        Add or update a book. Of the optional fields (series, isbn) only those given are stored, a lookup
+        that did not fetch them keeps what an earlier one recorded.
+        """
+        columns = {"title": title, "authors": json.dumps(authors, ensure_ascii=False), "updated": time.time()}
+        columns.update((name, fields[name]) for name in OPTIONAL_FIELDS if name in fields)
+        with self.storage.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO catalog_books (databazeknih_id, title, authors, updated) "
+                         "VALUES (?, ?, ?, ?)", (databazeknih_id, columns["title"], columns["authors"],
+                                                 columns["updated"]))
+            conn.execute("UPDATE catalog_books SET %s WHERE databazeknih_id = ?"
+                         % ", ".join("%s = ?" % name for name in columns), list(columns.values()) + [databazeknih_id])
+            conn.execute("DELETE FROM catalog_terms WHERE databazeknih_id = ?", (databazeknih_id,))
+            conn.executemany("INSERT OR IGNORE INTO catalog_terms (term, databazeknih_id) VALUES (?, ?)",
+                             [(term, databazeknih_id) for term in terms(title, authors)])
+
+    def candidates(self, title, authors, limit=MAX_CANDIDATES):
+        """
+        Books sharing most terms with the query - (DK id, title, authors)
+        """
+        query = sorted(terms(title, authors))
+        if not query:
+            return []
+        rows = self.storage.execute(
+            "SELECT b.databazeknih_id, b.title, b.authors FROM (SELECT databazeknih_id, COUNT(*) AS hits "
+            "FROM catalog_terms WHERE term IN (%s) GROUP BY databazeknih_id ORDER BY hits DESC LIMIT ?) t "
+            "JOIN catalog_books b ON b.databazeknih_id = t.databazeknih_id ORDER BY t.hits DESC"
+            % ", ".join("?" * len(query)), query + [limit]).fetchall()
+        return [(databazeknih_id, found_title, json.loads(found_authors))
+                for databazeknih_id, found_title, found_authors in rows]
+
+    def find(self, title, authors):
+        """
+        (DK id, score) of the best matching book if it clears the threshold, otherwise None
+        """
+        if not title:
+            return None
+        best = None
+        for databazeknih_id, found_title, found_authors in self.candidates(title, authors):
+            score = metadata_score(title, authors, found_title, found_authors)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (databazeknih_id, score)
+        return best
+
+
+def get_catalog():
+    """
+    """
+    return Catalog(get_storage())
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import argparse
+import importlib
+
+# Command name -> plugin module with add_arguments(parser) and run(plugin, opts)
+COMMANDS = {
+    "batch": "calibre_plugins.databazeknihcz.batch",
+    "benchmark": "calibre_plugins.databazeknihcz.benchmark",
+    "trace": "calibre_plugins.databazeknihcz.tracing",
+}
+
+
+def main(plugin, args):
+    """
+    Command line entry point, run as: calibre-debug -r DatabazeKnihCZ -- <command> [options]
+    """
+    parser = argparse.ArgumentParser(prog="calibre-debug -r %s --" % plugin.name)
+    subparsers = parser.add_subparsers(dest="command")
+    modules = {}
+    for name, module_name in sorted(COMMANDS.items()):
+        modules[name] = importlib.import_module(module_name)
+        modules[name].add_arguments(subparsers.add_parser(name))
+    opts = parser.parse_args(args)
+    if not opts.command:
+        parser.print_help()
+        return 1
+    return modules[opts.command].run(plugin, opts)
@@ -10,7 +10,7 @@ __license__ = 'GPL v3'
 __copyright__ = '2021, Tomas Vecera <tomas@vecera.dev>'
 __docformat__ = 'restructuredtext cs'
 
-from qt.core import QLabel, QGridLayout, Qt, QGroupBox, QCheckBox
+from qt.core import QLabel, QGridLayout, Qt, QGroupBox, QCheckBox, QSpinBox, QComboBox
 
 STORE_NAME = 'Options'
 
@@ -19,6 +19,30 @@ KEY_PARSE_COMMENTS = 'parseComments'
 KEY_PARSE_RATING = 'parseRating'
 KEY_ADD_DATABAZEKNIH_ID = 'addDatabazeKnihId'
 KEY_VERBOSE_LOGGING = 'verboseLogging'
+KEY_CACHE_TTL = 'cacheTtl'
+KEY_CACHE_SIZE = 'cacheSize'
+KEY_COVER_CACHE_SIZE = 'coverCacheSize'
+KEY_MAX_WORKERS = 'maxWorkers'
+KEY_STREAM_PARSE = 'streamParse'
+KEY_SEARCH_BACKEND = 'searchBackend'
+KEY_MAX_CANDIDATES = 'maxCandidates'
+KEY_TRACE = 'trace'
+KEY_KEEP_ALIVE = 'keepAlive'
+KEY_SERIES_PREFETCH = 'seriesPrefetch'
+KEY_SEARCH_CACHE_TTL = 'searchCacheTtl'
+KEY_SEARCH_MISS_TTL = 'searchMissTtl'
+KEY_AUTHOR_PREFETCH = 'authorPrefetch'
+KEY_CATALOG = 'catalog'
+KEY_HEDGE_SEARCH = 'hedgeSearch'
+KEY_HEDGE_DELAY = 'hedgeDelay'
+KEY_HEDGE_BUDGET = 'hedgeBudget'
+KEY_PARSE_PROCESSES = 'parseProcesses'
+
+SEARCH_BACKENDS = [
+    ('databazeknih', 'Databáze knih'),
+    ('google', 'Google'),
+    ('duckduckgo', 'DuckDuckGo'),
+]
 
 DEFAULT_STORE_VALUES = {
     KEY_PARSE_SERIES: True,
@@ -26,6 +50,24 @@ DEFAULT_STORE_VALUES = {
     KEY_PARSE_RATING: True,
     KEY_ADD_DATABAZEKNIH_ID: True,
     KEY_VERBOSE_LOGGING: False,
+    KEY_CACHE_TTL: 30,
+    KEY_CACHE_SIZE: 200,
+    KEY_COVER_CACHE_SIZE: 200,
+    KEY_MAX_WORKERS: 4,
+    KEY_STREAM_PARSE: True,
+    KEY_SEARCH_BACKEND: 'google',
+    KEY_MAX_CANDIDATES: 3,
+    KEY_TRACE: False,
+    KEY_KEEP_ALIVE: True,
+    KEY_SERIES_PREFETCH: False,
+    KEY_SEARCH_CACHE_TTL: 30,
+    KEY_SEARCH_MISS_TTL: 3,
+    KEY_AUTHOR_PREFETCH: False,
+    KEY_CATALOG: True,
+    KEY_HEDGE_SEARCH: False,
+    KEY_HEDGE_DELAY: 0,
+    KEY_HEDGE_BUDGET: 10,
+    KEY_PARSE_PROCESSES: 0,
 }
 
 # This is where all preferences for this plugin will be stored
@@ -49,6 +91,118 @@ class ConfigWidget(DefaultConfigWidget):
 
         index = 0
 
+        # Search backend - KEY_SEARCH_BACKEND
+        search_backend_label = QLabel('Vyhledávání knihy:', self)
+        search_backend_label.setToolTip('Kde plugin hledá odkaz na knihu podle názvu a autora.\n'
+                                        'Pokud vybrané vyhledávání nic nenajde, použijí se ostatní.\n'
+                                        'Vyhledávání, které opakovaně odmítá dotazy (429, captcha, timeout),\n'
+                                        'se na čas vynechá.\n'
+                                        )
+        other_group_box_layout.addWidget(search_backend_label, index, 0, 1, 1)
+
+        self.search_backend_combo = QComboBox(self)
+        for key, name in SEARCH_BACKENDS:
+            self.search_backend_combo.addItem(name, key)
+        self.search_backend_combo.setCurrentIndex(max(0, self.search_backend_combo.findData(
+            c.get(KEY_SEARCH_BACKEND, DEFAULT_STORE_VALUES[KEY_SEARCH_BACKEND]))))
+        other_group_box_layout.addWidget(self.search_backend_combo, index, 1, 1, 1)
+        index += 1
+
+        # Max candidates - KEY_MAX_CANDIDATES
+        max_candidates_label = QLabel('Počet stahovaných kandidátů:', self)
+        max_candidates_label.setToolTip('Kolik nejlépe odpovídajících výsledků vyhledávání plugin stáhne.\n'
+                                        'Stahování končí, jakmile některý z nich odpovídá názvu a autorovi.\n'
+                                        )
+        other_group_box_layout.addWidget(max_candidates_label, index, 0, 1, 1)
+
+        self.max_candidates_spinbox = QSpinBox(self)
+        self.max_candidates_spinbox.setRange(1, 10)
+        self.max_candidates_spinbox.setValue(c.get(KEY_MAX_CANDIDATES, DEFAULT_STORE_VALUES[KEY_MAX_CANDIDATES]))
+        other_group_box_layout.addWidget(self.max_candidates_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Search cache TTL - KEY_SEARCH_CACHE_TTL
+        search_cache_ttl_label = QLabel('Platnost uložených výsledků vyhledávání (dny):', self)
+        search_cache_ttl_label.setToolTip('Nalezené odkazy na knihy se ukládají a stejný název a autor\n'
+                                          '(i s jinou velikostí písmen, diakritikou či interpunkcí)\n'
+                                          'se znovu nevyhledává. Hodnota 0 ukládání vypne.\n'
+                                          )
+        other_group_box_layout.addWidget(search_cache_ttl_label, index, 0, 1, 1)
+
+        self.search_cache_ttl_spinbox = QSpinBox(self)
+        self.search_cache_ttl_spinbox.setRange(0, 365)
+        self.search_cache_ttl_spinbox.setValue(
+            c.get(KEY_SEARCH_CACHE_TTL, DEFAULT_STORE_VALUES[KEY_SEARCH_CACHE_TTL]))
+        other_group_box_layout.addWidget(self.search_cache_ttl_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Search miss TTL - KEY_SEARCH_MISS_TTL
+        search_miss_ttl_label = QLabel('Neopakovat neúspěšné vyhledávání (dny):', self)
+        search_miss_ttl_label.setToolTip('Knihy, které vyhledávání nenašlo, se po tuto dobu znovu nevyhledávají.\n'
+                                         'Hodnota 0 ukládání neúspěšných vyhledávání vypne.\n'
+                                         )
+        other_group_box_layout.addWidget(search_miss_ttl_label, index, 0, 1, 1)
+
+        self.search_miss_ttl_spinbox = QSpinBox(self)
+        self.search_miss_ttl_spinbox.setRange(0, 365)
+        self.search_miss_ttl_spinbox.setValue(
+            c.get(KEY_SEARCH_MISS_TTL, DEFAULT_STORE_VALUES[KEY_SEARCH_MISS_TTL]))
+        other_group_box_layout.addWidget(self.search_miss_ttl_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Hedged search - KEY_HEDGE_SEARCH
+        hedge_search_label = QLabel('Pomalé vyhledávání zkusit souběžně jinde:', self)
+        hedge_search_label.setToolTip('Pokud vyhledávání neodpoví do obvyklé doby, stejný dotaz se pošle\n'
+                                      'i do dalšího vyhledávání a použije se první odpověď s výsledky.\n'
+                                      )
+        other_group_box_layout.addWidget(hedge_search_label, index, 0, 1, 1)
+
+        self.hedge_search_checkbox = QCheckBox(self)
+        self.hedge_search_checkbox.setChecked(c.get(KEY_HEDGE_SEARCH, DEFAULT_STORE_VALUES[KEY_HEDGE_SEARCH]))
+        other_group_box_layout.addWidget(self.hedge_search_checkbox, index, 1, 1, 1)
+        index += 1
+
+        # Hedge delay - KEY_HEDGE_DELAY
+        hedge_delay_label = QLabel('Čekat na první vyhledávání (ms):', self)
+        hedge_delay_label.setToolTip('Po této době se dotaz pošle i do dalšího vyhledávání.\n'
+                                     'Hodnota 0 použije dobu, do které odpoví 90 % vyhledávání.\n'
+                                     )
+        other_group_box_layout.addWidget(hedge_delay_label, index, 0, 1, 1)
+
+        self.hedge_delay_spinbox = QSpinBox(self)
+        self.hedge_delay_spinbox.setRange(0, 30000)
+        self.hedge_delay_spinbox.setSingleStep(100)
+        self.hedge_delay_spinbox.setValue(c.get(KEY_HEDGE_DELAY, DEFAULT_STORE_VALUES[KEY_HEDGE_DELAY]))
+        other_group_box_layout.addWidget(self.hedge_delay_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Hedge budget - KEY_HEDGE_BUDGET
+        hedge_budget_label = QLabel('Nejvýše souběžných vyhledávání (%):', self)
+        hedge_budget_label.setToolTip('Kolik procent vyhledávání smí být posláno i do dalšího vyhledávání,\n'
+                                      'omezuje počet požadavků navíc. Hodnota 0 souběžné vyhledávání vypne.\n'
+                                      )
+        other_group_box_layout.addWidget(hedge_budget_label, index, 0, 1, 1)
+
+        self.hedge_budget_spinbox = QSpinBox(self)
+        self.hedge_budget_spinbox.setRange(0, 100)
+        self.hedge_budget_spinbox.setValue(c.get(KEY_HEDGE_BUDGET, DEFAULT_STORE_VALUES[KEY_HEDGE_BUDGET]))
+        other_group_box_layout.addWidget(self.hedge_budget_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Author prefetch - KEY_AUTHOR_PREFETCH
+        author_prefetch_label = QLabel('Načíst všechny knihy autora:', self)
+        author_prefetch_label.setToolTip('Stránka autora se stáhne jednou a uloží se seznam všech jeho knih.\n'
+                                         'Další knihy stejného autora se pak najdou bez vyhledávání.\n'
+                                         'Vhodné pro hromadné stahování metadat.\n'
+                                         )
+        other_group_box_layout.addWidget(author_prefetch_label, index, 0, 1, 1)
+
+        self.author_prefetch_checkbox = QCheckBox(self)
+        self.author_prefetch_checkbox.setChecked(
+            c.get(KEY_AUTHOR_PREFETCH, DEFAULT_STORE_VALUES[KEY_AUTHOR_PREFETCH]))
+        other_group_box_layout.addWidget(self.author_prefetch_checkbox, index, 1, 1, 1)
+        index += 1
+
         # Parse Series - KEY_PARSE_SERIES
         parse_series_label = QLabel('Načtení názvu knižní série a pořadí:', self)
         parse_series_label.setToolTip('Při vybrání této položky se plugin bude snažit dotáhnout informaci o \n'
@@ -62,6 +216,34 @@ class ConfigWidget(DefaultConfigWidget):
         other_group_box_layout.addWidget(self.parse_series_checkbox, index, 1, 1, 1)
         index += 1
 
+        # Catalog - KEY_CATALOG
+        catalog_label = QLabel('Hledat nejdříve v již stažených knihách:', self)
+        catalog_label.setToolTip('Každá zpracovaná kniha se uloží do místního katalogu\n'
+                                 '(název, autoři, série, ISBN).\n'
+                                 'Pokud v něm název a autor dostatečně odpovídá, vyhledávání na internetu\n'
+                                 'se přeskočí. Velikost písmen a diakritika se nerozlišují.\n'
+                                 )
+        other_group_box_layout.addWidget(catalog_label, index, 0, 1, 1)
+
+        self.catalog_checkbox = QCheckBox(self)
+        self.catalog_checkbox.setChecked(c.get(KEY_CATALOG, DEFAULT_STORE_VALUES[KEY_CATALOG]))
+        other_group_box_layout.addWidget(self.catalog_checkbox, index, 1, 1, 1)
+        index += 1
+
+        # Series prefetch - KEY_SERIES_PREFETCH
+        series_prefetch_label = QLabel('Načíst celou sérii najednou:', self)
+        series_prefetch_label.setToolTip('Stránka série se stáhne jednou a uloží se seznam všech jejích dílů.\n'
+                                         'Další díly série se pak najdou bez vyhledávání a pořadí v sérii\n'
+                                         'se bere ze seznamu dílů.\n'
+                                         )
+        other_group_box_layout.addWidget(series_prefetch_label, index, 0, 1, 1)
+
+        self.series_prefetch_checkbox = QCheckBox(self)
+        self.series_prefetch_checkbox.setChecked(
+            c.get(KEY_SERIES_PREFETCH, DEFAULT_STORE_VALUES[KEY_SERIES_PREFETCH]))
+        other_group_box_layout.addWidget(self.series_prefetch_checkbox, index, 1, 1, 1)
+        index += 1
+
         # Parse comments - KEY_PARSE_COMMENTS
         parse_comments_label = QLabel('Načtení popisu knihy:', self)
         parse_comments_label.setToolTip('Při vybrání této položky se plugin bude snažit dotáhnout popis\n'
@@ -111,12 +293,138 @@ class ConfigWidget(DefaultConfigWidget):
         other_group_box_layout.addWidget(self.verbose_loging_label_checkbox, index, 1, 1, 1)
         index += 1
 
+        # Cache TTL - KEY_CACHE_TTL
+        cache_ttl_label = QLabel('Platnost cache stažených stránek (dny):', self)
+        cache_ttl_label.setToolTip('Stažené stránky databazeknih.cz se ukládají na disk a při opakovaném\n'
+                                   'vyhledání stejné knihy se již znovu nestahují.\n'
+                                   'Hodnota 0 cache vypne.\n'
+                                   )
+        other_group_box_layout.addWidget(cache_ttl_label, index, 0, 1, 1)
+
+        self.cache_ttl_spinbox = QSpinBox(self)
+        self.cache_ttl_spinbox.setRange(0, 365)
+        self.cache_ttl_spinbox.setValue(c.get(KEY_CACHE_TTL, DEFAULT_STORE_VALUES[KEY_CACHE_TTL]))
+        other_group_box_layout.addWidget(self.cache_ttl_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Cache size - KEY_CACHE_SIZE
+        cache_size_label = QLabel('Maximální velikost cache (MB):', self)
+        cache_size_label.setToolTip('Po překročení velikosti se z cache mažou nejdéle nepoužité stránky.\n'
+                                    )
+        other_group_box_layout.addWidget(cache_size_label, index, 0, 1, 1)
+
+        self.cache_size_spinbox = QSpinBox(self)
+        self.cache_size_spinbox.setRange(1, 10000)
+        self.cache_size_spinbox.setValue(c.get(KEY_CACHE_SIZE, DEFAULT_STORE_VALUES[KEY_CACHE_SIZE]))
+        other_group_box_layout.addWidget(self.cache_size_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Cover cache size - KEY_COVER_CACHE_SIZE
+        cover_cache_size_label = QLabel('Maximální velikost cache obálek (MB):', self)
+        cover_cache_size_label.setToolTip('Stažené obálky se ukládají na disk.\n'
+                                          'Po uplynutí platnosti cache se jen ověří, zda se obálka na serveru nezměnila.\n'
+                                          )
+        other_group_box_layout.addWidget(cover_cache_size_label, index, 0, 1, 1)
+
+        self.cover_cache_size_spinbox = QSpinBox(self)
+        self.cover_cache_size_spinbox.setRange(1, 10000)
+        self.cover_cache_size_spinbox.setValue(
+            c.get(KEY_COVER_CACHE_SIZE, DEFAULT_STORE_VALUES[KEY_COVER_CACHE_SIZE]))
+        other_group_box_layout.addWidget(self.cover_cache_size_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Max workers - KEY_MAX_WORKERS
+        max_workers_label = QLabel('Počet souběžných stahování:', self)
+        max_workers_label.setToolTip('Kolik stránek z databazeknih.cz může plugin stahovat najednou.\n'
+                                     'Rychlost požadavků i tak omezuje ochrana proti zablokování (HTTP 429).\n'
+                                     )
+        other_group_box_layout.addWidget(max_workers_label, index, 0, 1, 1)
+
+        self.max_workers_spinbox = QSpinBox(self)
+        self.max_workers_spinbox.setRange(1, 16)
+        self.max_workers_spinbox.setValue(c.get(KEY_MAX_WORKERS, DEFAULT_STORE_VALUES[KEY_MAX_WORKERS]))
+        other_group_box_layout.addWidget(self.max_workers_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Parse processes - KEY_PARSE_PROCESSES
+        parse_processes_label = QLabel('Počet procesů pro zpracování stránek (experimentální):', self)
+        parse_processes_label.setToolTip('Stránky se zpracují v samostatných procesech\n'
+                                         'a využijí více jader procesoru. Vhodné pro hromadné stahování metadat,\n'
+                                         'stránka knihy se pak vždy stáhne celá.\n'
+                                         'Experimentální - pokud se plugin v nových procesech nenačte,\n'
+                                         'stránky se zpracují ve vláknech pluginu.\n'
+                                         'Hodnota 0 (výchozí) zpracovává stránky přímo ve vláknech pluginu.\n'
+                                         )
+        other_group_box_layout.addWidget(parse_processes_label, index, 0, 1, 1)
+
+        self.parse_processes_spinbox = QSpinBox(self)
+        self.parse_processes_spinbox.setRange(0, 32)
+        self.parse_processes_spinbox.setValue(
+            c.get(KEY_PARSE_PROCESSES, DEFAULT_STORE_VALUES[KEY_PARSE_PROCESSES]))
+        other_group_box_layout.addWidget(self.parse_processes_spinbox, index, 1, 1, 1)
+        index += 1
+
+        # Stream parse - KEY_STREAM_PARSE
+        stream_parse_label = QLabel('Stahovat jen začátek stránky knihy:', self)
+        stream_parse_label.setToolTip('Stránka knihy se zpracovává už během stahování a stahování skončí,\n'
+                                      'jakmile jsou načtené všechny potřebné údaje (bez komentářů a diskuze).\n'
+                                      )
+        other_group_box_layout.addWidget(stream_parse_label, index, 0, 1, 1)
+
+        self.stream_parse_checkbox = QCheckBox(self)
+        self.stream_parse_checkbox.setChecked(c.get(KEY_STREAM_PARSE, DEFAULT_STORE_VALUES[KEY_STREAM_PARSE]))
+        other_group_box_layout.addWidget(self.stream_parse_checkbox, index, 1, 1, 1)
+        index += 1
+
+        # Keep-alive - KEY_KEEP_ALIVE
+        keep_alive_label = QLabel('Udržovat spojení se serverem:', self)
+        keep_alive_label.setToolTip('Spojení s databazeknih.cz a vyhledávačem se používají opakovaně\n'
+                                    'a stránky se stahují komprimované (gzip, brotli).\n'
+                                    'Při nastavené proxy se vždy použije stahování přes Calibre.\n'
+                                    )
+        other_group_box_layout.addWidget(keep_alive_label, index, 0, 1, 1)
+
+        self.keep_alive_checkbox = QCheckBox(self)
+        self.keep_alive_checkbox.setChecked(c.get(KEY_KEEP_ALIVE, DEFAULT_STORE_VALUES[KEY_KEEP_ALIVE]))
+        other_group_box_layout.addWidget(self.keep_alive_checkbox, index, 1, 1, 1)
+        index += 1
+
+        # Trace - KEY_TRACE
+        trace_label = QLabel('Zaznamenávat časy jednotlivých kroků:', self)
+        trace_label.setToolTip('Doba hledání, stahování a zpracování stránek se zapisuje do složky traces\n'
+                               'v cache pluginu. Souhrn vypíše: calibre-debug -r DatabazeKnihCZ -- trace\n'
+                               )
+        other_group_box_layout.addWidget(trace_label, index, 0, 1, 1)
+
+        self.trace_checkbox = QCheckBox(self)
+        self.trace_checkbox.setChecked(c.get(KEY_TRACE, DEFAULT_STORE_VALUES[KEY_TRACE]))
+        other_group_box_layout.addWidget(self.trace_checkbox, index, 1, 1, 1)
+        index += 1
+
     def commit(self):
         DefaultConfigWidget.commit(self)
         new_prefs = {KEY_PARSE_SERIES: self.parse_series_checkbox.isChecked(),
                      KEY_PARSE_COMMENTS: self.parse_comments_checkbox.isChecked(),
                      KEY_PARSE_RATING: self.parse_rating_checkbox.isChecked(),
                      KEY_ADD_DATABAZEKNIH_ID: self.add_databazeknih_id_checkbox.isChecked(),
-                     KEY_VERBOSE_LOGGING: self.verbose_loging_label_checkbox.isChecked()}
+                     KEY_VERBOSE_LOGGING: self.verbose_loging_label_checkbox.isChecked(),
+                     KEY_CACHE_TTL: self.cache_ttl_spinbox.value(),
+                     KEY_CACHE_SIZE: self.cache_size_spinbox.value(),
+                     KEY_COVER_CACHE_SIZE: self.cover_cache_size_spinbox.value(),
+                     KEY_MAX_WORKERS: self.max_workers_spinbox.value(),
+                     KEY_STREAM_PARSE: self.stream_parse_checkbox.isChecked(),
+                     KEY_SEARCH_BACKEND: self.search_backend_combo.currentData(),
+                     KEY_MAX_CANDIDATES: self.max_candidates_spinbox.value(),
+                     KEY_TRACE: self.trace_checkbox.isChecked(),
+                     KEY_KEEP_ALIVE: self.keep_alive_checkbox.isChecked(),
+                     KEY_SERIES_PREFETCH: self.series_prefetch_checkbox.isChecked(),
+                     KEY_SEARCH_CACHE_TTL: self.search_cache_ttl_spinbox.value(),
+                     KEY_SEARCH_MISS_TTL: self.search_miss_ttl_spinbox.value(),
+                     KEY_AUTHOR_PREFETCH: self.author_prefetch_checkbox.isChecked(),
+                     KEY_CATALOG: self.catalog_checkbox.isChecked(),
+                     KEY_HEDGE_SEARCH: self.hedge_search_checkbox.isChecked(),
+                     KEY_HEDGE_DELAY: self.hedge_delay_spinbox.value(),
+                     KEY_HEDGE_BUDGET: self.hedge_budget_spinbox.value(),
+                     KEY_PARSE_PROCESSES: self.parse_processes_spinbox.value()}
 
         plugin_prefs[STORE_NAME] = new_prefs
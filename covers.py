@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import hashlib
+import io
+import os
+import time
+
+from calibre_plugins.databazeknihcz.net import NOT_MODIFIED, fetch
+from calibre_plugins.databazeknihcz.singleflight import get_single_flight
+from calibre_plugins.databazeknihcz.storage import get_storage, storage_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS covers (
+    databazeknih_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    digest TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    validated REAL NOT NULL DEFAULT 0,
+    accessed REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS covers_accessed ON covers (accessed);
+CREATE INDEX IF NOT EXISTS covers_digest ON covers (digest);
+"""
+
+
+class CoverStore(object):
+    """
+    Persistent DK id -> cover url mapping with content addressed cover images (LRU, size cap).
+    Stale images are revalidated with If-None-Match / If-Modified-Since.
+    """
+
+    def __init__(self, storage, directory, max_age, max_size):
+        self.storage = storage
+        self.directory = directory
+        self.max_age = max_age
+        self.max_size = max_size
+        self.storage.ensure_schema("covers", SCHEMA)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def path(self, digest):
+        """
+        """
+        return os.path.join(self.directory, digest)
+
+    def url(self, databazeknih_id):
+        """
+        Cover url of a book parsed before or None
+        """
+        row = self.storage.execute("SELECT url FROM covers WHERE databazeknih_id = ?", (databazeknih_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_url(self, databazeknih_id, url):
+        """
+        Remember cover url, a stored image is kept only while the url stays the same
+        """
+        removed = []
+        with self.storage.transaction() as conn:
+            row = conn.execute("SELECT url, digest FROM covers WHERE databazeknih_id = ?",
+                               (databazeknih_id,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO covers (databazeknih_id, url) VALUES (?, ?)", (databazeknih_id, url))
+            elif row[0] != url:
+                conn.execute("UPDATE covers SET url = ?, digest = NULL, etag = NULL, last_modified = NULL, size = 0, "
+                             "validated = 0 WHERE databazeknih_id = ?", (url, databazeknih_id))
+                removed = self.unreferenced(conn, row[1])
+        self.remove(removed)
+
+    def read(self, digest):
+        """
+        """
+        try:
+            with io.open(self.path(digest), "rb") as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def write(self, data):
+        """
+        Store image under its digest, return the digest
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with io.open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def download(self, browser, log, databazeknih_id, url, timeout=30, deadline=None):
+        """
+        Cover image for the book - from disk while fresh, revalidated when stale, downloaded otherwise.
+        Concurrent downloads of the same cover, in this or other processes, run only once.
+        """
+        return get_single_flight().run("cover:" + databazeknih_id,
+                                       lambda: self.load(browser, log, databazeknih_id, url, timeout, deadline),
+                                       deadline, shared=True)
+
+    def load(self, browser, log, databazeknih_id, url, timeout=30, deadline=None):
+        """
+        """
+        now = time.time()
+        row = self.storage.execute("SELECT url, digest, etag, last_modified, validated FROM covers "
+                                   "WHERE databazeknih_id = ?", (databazeknih_id,)).fetchone()
+        data = None
+        headers = {}
+        if row is not None and row[0] == url and row[1]:
+            data = self.read(row[1])
+        if data is not None:
+            if now - row[4] < self.max_age:
+                log.info("Cover from disk cache: %r" % url)
+                self.storage.execute("UPDATE covers SET accessed = ? WHERE databazeknih_id = ?",
+                                     (now, databazeknih_id))
+                return data
+            if row[2]:
+                headers["If-None-Match"] = row[2]
+            if row[3]:
+                headers["If-Modified-Since"] = row[3]
+
+        status, body, response_headers = fetch(browser, url, log, timeout=timeout, headers=headers or None,
+                                                  deadline=deadline)
+        if status == NOT_MODIFIED and data is not None:
+            log.info("Cover not modified: %r" % url)
+            self.storage.execute("UPDATE covers SET validated = ?, accessed = ? WHERE databazeknih_id = ?",
+                                 (now, now, databazeknih_id))
+            return data
+        if not body:
+            return None
+
+        digest = self.write(body)
+        etag = response_headers.get("ETag") if response_headers is not None else None
+        last_modified = response_headers.get("Last-Modified") if response_headers is not None else None
+        with self.storage.transaction() as conn:
+            old = conn.execute("SELECT digest FROM covers WHERE databazeknih_id = ?", (databazeknih_id,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO covers (databazeknih_id, url, digest, etag, last_modified, size, "
+                         "validated, accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (databazeknih_id, url, digest, etag, last_modified, len(body), now, now))
+            # Image replaced by a changed cover is not counted by the size cap any more
+            removed = self.unreferenced(conn, old[0] if old else None) + self.evict(conn)
+        self.remove(removed)
+        return body
+
+    def unreferenced(self, conn, digest):
+        """
+        [digest] when no book uses the image any more, otherwise []
+        """
+        if not digest or conn.execute("SELECT 1 FROM covers WHERE digest = ?", (digest,)).fetchone() is not None:
+            return []
+        return [digest]
+
+    def evict(self, conn):
+        """
+        Forget least recently used images over the size cap, return digests no longer referenced
+        """
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM covers WHERE digest IS NOT NULL").fetchone()[0]
+        removed = []
+        if total <= self.max_size:
+            return removed
+        over = total - self.max_size
+        victims = []
+        for databazeknih_id, digest, size in conn.execute("SELECT databazeknih_id, digest, size FROM covers "
+                                                          "WHERE digest IS NOT NULL ORDER BY accessed"):
+            victims.append((databazeknih_id, digest))
+            over -= size
+            if over <= 0:
+                break
+        for databazeknih_id, digest in victims:
+            # The url mapping stays, only the image goes
+            conn.execute("UPDATE covers SET digest = NULL, etag = NULL, last_modified = NULL, size = 0 "
+                         "WHERE databazeknih_id = ?", (databazeknih_id,))
+            removed.extend(self.unreferenced(conn, digest))
+        return removed
+
+    def remove(self, digests):
+        """
+        """
+        for digest in digests:
+            try:
+                os.remove(self.path(digest))
+            except OSError:
+                pass
+
+
+def get_cover_store(plugin):
+    """
+    Cover store configured from plugin preferences
+    """
+    return CoverStore(get_storage(), os.path.join(storage_dir(), "covers"), plugin.cfg_cache_ttl * 24 * 3600,
+                      plugin.cfg_cover_cache_size * 1024 * 1024)
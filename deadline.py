@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import threading
+import time
+
+# Smallest timeout given to a single request, tiny shares of the budget would only produce timeouts
+MIN_REQUEST_TIMEOUT = 2.0
+
+
+class Cancelled(Exception):
+    """
+    Lookup was aborted or ran out of its time budget
+    """
+
+
+class Deadline(object):
+    """
+    Time budget of one identify / download_cover call together with its abort flag.
+    Requests take their timeout from the remaining budget, open responses are closed on cancel().
+    """
+
+    def __init__(self, timeout, abort=None, parent=None):
+        self.expires = time.time() + timeout
+        self.abort = abort
+        self.parent = parent
+        self.cancelled = False
+        self.responses = set()
+        # Cancelled together with this one, their connections are closed as well
+        self.children = []
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """
+        """
+        return max(0.0, self.expires - time.time())
+
+    def expired(self):
+        """
+        """
+        return self.cancelled or self.remaining() <= 0 or (self.abort is not None and self.abort.is_set()) or (
+            self.parent is not None and self.parent.expired())
+
+    def child(self, timeout=None):
+        """
+        Deadline within this one that can be cancelled alone, e.g. the slower of two hedged requests,
+        with timeout it expires earlier than this one
+        """
+        remaining = self.remaining()
+        child = Deadline(remaining if timeout is None else min(timeout, remaining), self.abort, parent=self)
+        with self.lock:
+            self.children.append(child)
+        if self.cancelled:
+            child.cancel()
+        return child
+
+    def check(self):
+        """
+        Raise Cancelled when the lookup should stop
+        """
+        if self.expired():
+            raise Cancelled(self.reason())
+
+    def reason(self):
+        """
+        Why an expired deadline stopped the lookup
+        """
+        return "Aborted" if self.cancelled or self.remaining() > 0 else "Time budget exhausted"
+
+    def timeout(self, steps=1):
+        """
+        Timeout for the next of steps sequential requests, the remaining budget is split evenly
+        """
+        self.check()
+        remaining = self.remaining()
+        return min(remaining, max(remaining / steps, MIN_REQUEST_TIMEOUT))
+
+    def sleep(self, seconds):
+        """
+        Sleep interrupted by abort
+        """
+        if self.abort is not None:
+            self.abort.wait(seconds)
+        else:
+            time.sleep(seconds)
+        self.check()
+
+    def register(self, response):
+        """
+        """
+        with self.lock:
+            self.responses.add(response)
+        if self.cancelled:
+            self.close(response)
+
+    def unregister(self, response):
+        """
+        """
+        with self.lock:
+            self.responses.discard(response)
+
+    def cancel(self):
+        """
+        Stop the lookup - pending reads fail, open connections (also of child deadlines) are closed
+        so the pool threads are freed
+        """
+        self.cancelled = True
+        with self.lock:
+            responses = list(self.responses)
+            self.responses.clear()
+            children = list(self.children)
+        for response in responses:
+            self.close(response)
+        for child in children:
+            child.cancel()
+
+    def close(self, response):
+        """
+        """
+        try:
+            response.close()
+        except:
+            pass
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# How often a waiting identify looks at the abort flag (seconds)
+ABORT_CHECK_INTERVAL = 0.5
+
+_executor = None
+_executor_size = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(max_workers):
+    """
+    Bounded thread pool shared by all identify / download_cover calls of this process
+    """
+    global _executor, _executor_size
+    with _executor_lock:
+        if _executor is None or _executor_size != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="databazeknihcz")
+            _executor_size = max_workers
+        return _executor
+
+
+def result_inline(future, fn, *args):
+    """
+    Result of a future submitted from inside a pool task. If no pool thread picked it up yet,
+    it is run in the calling thread instead - waiting for it could exhaust the bounded pool.
+    """
+    if future.cancel():
+        return fn(*args)
+    return future.result()
+
+
+def wait_all(futures, abort, deadline=None):
+    """
+    Wait until all futures are done, abort is set or the deadline passes.
+    Pending futures are cancelled then and the deadline closes connections of the running ones.
+    """
+    pending = set(futures)
+    while pending and not abort.is_set() and not (deadline is not None and deadline.expired()):
+        done, pending = wait(pending, timeout=ABORT_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+    for future in pending:
+        future.cancel()
+    if pending and deadline is not None:
+        deadline.cancel()
+    return not pending
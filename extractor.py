@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+from collections import namedtuple
+
+from lxml import etree
+
+# Precompiled queries, evaluated once per page
+ITEMPROP = etree.XPath("//*[@itemprop]")
+SERIES_INFO = etree.XPath("//em[@class='info']")
+RATING = etree.XPath("//a[@class='bpoints']/div/text()")
+COVER = etree.XPath("//*[@id='icover_mid']//img[@class='kniha_img']/@src")
+BID = etree.XPath("//span[@id='abinfo']/@bid")
+HEADER = etree.XPath("//h1/text()")
+
+# Relative queries, evaluated on single elements
+TEXT = etree.XPath("text()")
+LINK_TEXT = etree.XPath("a/text()")
+LINK_HREF = etree.XPath("a/@href")
+SPAN_TEXT = etree.XPath("span/text()")
+
+# Comments converted to HTML are filled in only when the page is parsed in the parse pool
+DetailRecord = namedtuple("DetailRecord", [
+    "title", "authors", "publisher", "pubdate", "tags", "isbn", "language", "comments",
+    "series", "series_index", "series_url", "rating", "cover", "bid", "author_urls", "comments_html"],
+    defaults=[None])
+
+
+# Fields of a book page, each one is complete once the element holding it is closed
+PAGE_MARKERS = frozenset([
+    "title", "authors", "publisher", "pubdate", "tags", "comments", "series", "rating", "cover", "bid"])
+# Cover url only, the page is read up to the cover image
+COVER_MARKERS = frozenset(["cover"])
+
+
+def end_marker(node):
+    """
+    Field completed by the end of node or None
+    """
+    tag = node.tag
+    prop = node.get("itemprop")
+    if prop is not None:
+        if tag == "h1" and prop == "name":
+            return "title"
+        if tag == "span" and prop == "publisher":
+            return "publisher"
+        if tag == "span" and prop == "datePublished":
+            return "pubdate"
+        if tag == "h5" and prop == "genre":
+            return "tags"
+        if tag == "p" and prop == "description":
+            return "comments"
+        return None
+    if tag == "h2" and node.get("class") == "jmenaautoru":
+        return "authors"
+    if tag == "em" and node.get("class") == "info":
+        return "series"
+    if tag == "a" and node.get("class") == "bpoints":
+        return "rating"
+    node_id = node.get("id")
+    if node_id == "icover_mid":
+        return "cover"
+    if tag == "span" and node_id == "abinfo":
+        return "bid"
+    return None
+
+
+class IncrementalParser(object):
+    """
+    Builds the page tree from chunks and tells when all wanted fields were seen, so the rest of the page
+    (comments, discussion, recommendations) does not have to be downloaded
+    """
+
+    def __init__(self, markers=PAGE_MARKERS):
+        self.parser = etree.HTMLPullParser(events=("end",))
+        self.pending = set(markers)
+        self.size = 0
+
+    def feed(self, data):
+        """
+        Feed next chunk, return True when all wanted fields are complete
+        """
+        self.size += len(data)
+        self.parser.feed(data)
+        for event, node in self.parser.read_events():
+            if self.pending:
+                self.pending.discard(end_marker(node))
+        return not self.pending
+
+    @property
+    def done(self):
+        """
+        """
+        return not self.pending
+
+    def close(self):
+        """
+        Root of the (possibly partial) tree
+        """
+        return self.parser.close()
+
+
+def strings(nodes):
+    """
+    Plain strings - lxml smart strings keep the whole tree alive
+    """
+    return [str(node) for node in nodes]
+
+
+def extract_header(root):
+    """
+    Text of h1 elements, used for detecting the DK 404 page
+    """
+    return strings(HEADER(root))
+
+
+def extract(root):
+    """
+    Extract all DK fields from a book page (or a more info fragment) in a single walk over the microdata
+    """
+    fields = {
+        "name": [], "author": [], "publisher": [], "datePublished": [], "genre": [], "isbn": [], "language": []
+    }
+    author_urls = []
+    description_spans = []
+    description_texts = []
+
+    for node in ITEMPROP(root):
+        prop = node.get("itemprop")
+        tag = node.tag
+        if prop == "name":
+            if tag == "h1":
+                fields[prop].extend(TEXT(node))
+        elif prop == "author":
+            parent = node.getparent()
+            if tag == "span" and parent is not None and parent.tag == "h2" and parent.get("class") == "jmenaautoru":
+                fields[prop].extend(LINK_TEXT(node))
+                author_urls.extend(LINK_HREF(node))
+        elif prop == "publisher":
+            if tag == "span":
+                fields[prop].extend(LINK_TEXT(node))
+        elif prop == "genre":
+            if tag == "h5":
+                fields[prop].extend(LINK_TEXT(node))
+        elif prop in ("datePublished", "isbn", "language"):
+            if tag == "span":
+                fields[prop].extend(TEXT(node))
+        elif prop == "description":
+            if tag == "p":
+                description_spans.extend(SPAN_TEXT(node))
+                description_texts.extend(TEXT(node))
+
+    # Series name and link are siblings of the em element holding the index
+    series, series_index, series_url = [], [], []
+    parents = []
+    for node in SERIES_INFO(root):
+        series_index.extend(TEXT(node))
+        parent = node.getparent()
+        if parent is not None and parent not in parents:
+            parents.append(parent)
+    for parent in parents:
+        series.extend(LINK_TEXT(parent))
+        series_url.extend(LINK_HREF(parent))
+
+    return DetailRecord(
+        title=strings(fields["name"]),
+        authors=strings(fields["author"]),
+        publisher=strings(fields["publisher"]),
+        pubdate=strings(fields["datePublished"]),
+        tags=strings(fields["genre"]),
+        isbn=strings(fields["isbn"]),
+        language=strings(fields["language"]),
+        comments=strings(description_spans or description_texts),
+        series=strings(series),
+        series_index=strings(series_index),
+        series_url=strings(series_url),
+        rating=strings(RATING(root)),
+        cover=strings(COVER(root)),
+        bid=strings(BID(root)),
+        author_urls=strings(author_urls),
+    )
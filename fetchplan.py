@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+# Optional fields of the book page and of the more info fragment
+PAGE_FIELDS = frozenset(["series", "comments", "publisher", "pubdate", "tags", "rating"])
+MORE_INFO_FIELDS = frozenset(["isbn", "languages"])
+# Always parsed - title and authors make the result, the cover url is cached for download_cover
+REQUIRED_MARKERS = frozenset(["title", "authors", "cover"])
+
+# Field names in calibre's ignore_fields where they differ
+CALIBRE_NAMES = {"isbn": "identifier:isbn"}
+
+
+class FetchPlan(object):
+    """
+    Fields a lookup needs - decides which requests are sent, how much of the page is read and what is parsed
+    """
+
+    def __init__(self, fields, isbn=None):
+        self.fields = frozenset(fields) & (PAGE_FIELDS | MORE_INFO_FIELDS)
+        # ISBN known from the identifiers of a book resolved without searching, set on the result as is
+        self.isbn = isbn
+
+    def wants(self, field):
+        """
+        """
+        return field in self.fields
+
+    @property
+    def more_info(self):
+        """
+        Is the more info fragment (ISBN, language) requested
+        """
+        return bool(self.fields & MORE_INFO_FIELDS)
+
+    @property
+    def markers(self):
+        """
+        Page fields the incremental parser waits for, the page is read only until these are complete
+        """
+        markers = REQUIRED_MARKERS | (self.fields & PAGE_FIELDS)
+        if self.more_info:
+            markers |= {"bid"}
+        return markers
+
+    def __repr__(self):
+        return "FetchPlan(%s, more_info=%s)" % (", ".join(sorted(self.fields)) or "-", self.more_info)
+
+
+FULL_PLAN = FetchPlan(PAGE_FIELDS | MORE_INFO_FIELDS)
+COVER_PLAN = FetchPlan([])
+
+
+def ignored_fields():
+    """
+    Fields the user told calibre not to download (metadata download preferences)
+    """
+    try:
+        from calibre.ebooks.metadata.sources.prefs import msprefs
+        return frozenset(msprefs["ignore_fields"])
+    except:
+        return frozenset()
+
+
+def fetch_plan(plugin, isbn=None, ignored=None):
+    """
+    Plan from the plugin config and calibre's ignored fields. With a known ISBN the more info fragment
+    is requested only for the language.
+    """
+    if ignored is None:
+        ignored = ignored_fields()
+    disabled = {"series": plugin.cfg_parse_series, "comments": plugin.cfg_parse_comments,
+                "rating": plugin.cfg_parse_rating}
+    fields = set()
+    for field in PAGE_FIELDS | MORE_INFO_FIELDS:
+        if CALIBRE_NAMES.get(field, field) not in ignored and disabled.get(field, True):
+            fields.add(field)
+    if isbn:
+        fields.discard("isbn")
+    return FetchPlan(fields, isbn=isbn if "identifier:isbn" not in ignored else None)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from calibre_plugins.databazeknihcz.tracing import percentile
+
+# Latest search latencies kept per provider
+SAMPLES = 50
+# Latencies needed before the observed p90 is used as the hedge delay
+MIN_SAMPLES = 5
+# Hedge delay (seconds) while too few latencies are known
+DEFAULT_DELAY = 3.0
+# Searches running at once - the primary and the hedge of a few concurrent lookups
+SEARCH_THREADS = 4
+
+
+class Hedger(object):
+    """
+    Decides when a slow search is repeated with the next provider: after the configured delay or the observed
+    p90 latency of the provider, and only while hedged searches stay within the budget (percent of searches)
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.searches = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def observe(self, provider, seconds):
+        """
+        Latency of a search that answered
+        """
+        with self.lock:
+            self.latencies.setdefault(provider, deque(maxlen=SAMPLES)).append(seconds)
+
+    def delay(self, provider, configured=0):
+        """
+        Seconds to wait for provider before hedging, configured (milliseconds) or its p90 latency
+        """
+        if configured:
+            return configured / 1000.0
+        with self.lock:
+            samples = list(self.latencies.get(provider, ()))
+        if len(samples) < MIN_SAMPLES:
+            return DEFAULT_DELAY
+        return percentile(samples, 0.9)
+
+    def started(self):
+        """
+        """
+        with self.lock:
+            self.searches += 1
+
+    def allow(self, budget):
+        """
+        Take one hedge from the budget (percent of searches), the first hedge is always allowed
+        unless the budget is 0 (hedging disabled)
+        """
+        if budget <= 0:
+            return False
+        with self.lock:
+            if self.hedges >= max(1.0, self.searches * budget / 100.0):
+                return False
+            self.hedges += 1
+            return True
+
+    def submit(self, fn, *args):
+        """
+        Run a search in the search pool, apart from the worker pool so book pages do not hold it up
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS,
+                                                   thread_name_prefix="databazeknihcz-search")
+            return self.executor.submit(fn, *args)
+
+    def stats(self):
+        """
+        Searches and hedged searches since the process started
+        """
+        with self.lock:
+            return {"searches": self.searches, "hedges": self.hedges}
+
+
+_hedger = Hedger()
+
+
+def get_hedger():
+    """
+    Process wide Hedger instance
+    """
+    return _hedger
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import time
+
+from calibre_plugins.databazeknihcz.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS isbn_index (
+    isbn TEXT PRIMARY KEY,
+    databazeknih_id TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+class IsbnIndex(object):
+    """
+    Persistent ISBN -> DK id mapping, filled by every parsed book
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.storage.ensure_schema("isbn_index", SCHEMA)
+
+    def get(self, isbn):
+        """
+        """
+        row = self.storage.execute("SELECT databazeknih_id FROM isbn_index WHERE isbn = ?", (isbn,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, isbn, databazeknih_id):
+        """
+        """
+        self.storage.execute("INSERT OR REPLACE INTO isbn_index (isbn, databazeknih_id, updated) VALUES (?, ?, ?)",
+                             (isbn, databazeknih_id, time.time()))
+
+
+def get_isbn_index():
+    """
+    """
+    return IsbnIndex(get_storage())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import re
+import unicodedata
+
+# Score from which a candidate is taken as the right book and the lookup stops
+CONFIDENCE = 0.9
+# Weight of the title in the score, the rest belongs to the first author
+TITLE_WEIGHT = 0.7
+
+NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+SLUG_ID = re.compile(r"-\d+$")
+
+
+def fold(text):
+    """
+    Lower case text without Czech (and other) diacritics and punctuation
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return NON_WORD.sub(" ", text.lower()).strip()
+
+
+def tokens(text):
+    """
+    """
+    return fold(text).split()
+
+
+def slug_tokens(url):
+    """
+    Words of the DK book id in url, e.g. .../knihy/hra-o-truny-12345 -> hra, o, truny
+    """
+    slug = url.rstrip("/").rsplit("/", 1)[-1]
+    return SLUG_ID.sub("", slug).split("-")
+
+
+def coverage(wanted, found):
+    """
+    Part of wanted words present in found words
+    """
+    wanted = set(wanted)
+    if not wanted:
+        return 0.0
+    return len(wanted & set(found)) / float(len(wanted))
+
+
+def score(title, authors, found_words):
+    """
+    How well do found words match title and first author, 0 - 1
+    """
+    title_score = coverage(tokens(title), found_words)
+    if not authors:
+        return title_score
+    return TITLE_WEIGHT * title_score + (1 - TITLE_WEIGHT) * coverage(tokens(authors[0]), found_words)
+
+
+def candidate_score(title, authors, url, text):
+    """
+    Cheap score of a search result from its url slug and snippet text
+    """
+    return score(title, authors, set(slug_tokens(url)) | set(tokens(text)))
+
+
+def metadata_score(title, authors, found_title, found_authors):
+    """
+    Score of a fully parsed book, the title has to match in both directions
+    """
+    found_words = tokens(found_title)
+    for author in found_authors or []:
+        found_words.extend(tokens(author))
+    title_score = min(coverage(tokens(title), found_words), coverage(tokens(found_title), tokens(title)))
+    if not authors:
+        return title_score
+    return TITLE_WEIGHT * title_score + (1 - TITLE_WEIGHT) * coverage(tokens(authors[0]), found_words)
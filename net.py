@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import time
+from urllib.parse import urlparse
+
+from mechanize import Request
+
+from calibre_plugins.databazeknihcz.ratelimit import get_rate_limiter, parse_retry_after
+from calibre_plugins.databazeknihcz.tracing import get_tracer
+from calibre_plugins.databazeknihcz.transport import get_transport
+
+# HTTP status codes that mean "slow down"
+THROTTLE_CODES = (429, 503)
+NOT_MODIFIED = 304
+# Read size for streamed responses
+CHUNK_SIZE = 16 * 1024
+
+
+def error_code(e):
+    """
+    HTTP status code of a browser exception or None
+    """
+    if callable(getattr(e, "getcode", None)):
+        return e.getcode()
+    return getattr(e, "code", None)
+
+
+def error_retry_after(e):
+    """
+    """
+    headers = getattr(e, "hdrs", None) or getattr(e, "headers", None)
+    if headers is None:
+        return None
+    return parse_retry_after(headers.get("Retry-After"))
+
+
+def request_headers(browser, headers=None):
+    """
+    Browser's default headers (User-Agent, ...) for requests sent through the pooled transport
+    """
+    result = dict((name, value) for name, value in getattr(browser, "addheaders", [])
+                  if name.lower() != "accept-encoding")
+    result.update(headers or {})
+    return result
+
+
+def open_response(browser, url, log, timeout=30, headers=None, deadline=None):
+    """
+    Open url through the shared per-host rate limiter, return the response for reading.
+    Responses 429 / 503 slow down further requests to the host.
+    With a deadline the timeout is capped by the remaining time budget of the lookup.
+    """
+    if deadline is not None:
+        timeout = min(timeout, deadline.timeout())
+    host = urlparse(url).hostname
+    limiter = get_rate_limiter()
+    waited = limiter.acquire(host, max_wait=timeout, deadline=deadline)
+    if waited:
+        log.info("Throttled request to %s for %.2f s" % (host, waited))
+        get_tracer().add("throttle", time.time() - waited, waited, {"host": host})
+    transport = get_transport()
+    try:
+        if transport.enabled:
+            response = transport.open(url, headers=request_headers(browser, headers), timeout=timeout)
+        else:
+            response = browser.open_novisit(Request(url, headers=headers) if headers else url, timeout=timeout)
+    except Exception as e:
+        if error_code(e) == NOT_MODIFIED:
+            limiter.reward(host)
+        elif error_code(e) in THROTTLE_CODES:
+            blocked = limiter.penalize(host, error_retry_after(e))
+            log.error("HTTP %s from %s, requests paused for %.0f s" % (error_code(e), host, blocked))
+        raise
+    limiter.reward(host)
+    return response
+
+
+def fetch(browser, url, log, timeout=30, headers=None, deadline=None):
+    """
+    Download url, return (status, body, response headers).
+    Status 304 (Not Modified) comes back with no body.
+    """
+    with get_tracer().span("fetch", url=url) as attrs:
+        try:
+            response = open_response(browser, url, log, timeout=timeout, headers=headers, deadline=deadline)
+        except Exception as e:
+            attrs["status"] = error_code(e)
+            if error_code(e) == NOT_MODIFIED:
+                return NOT_MODIFIED, None, getattr(e, "hdrs", None)
+            raise
+        try:
+            body = b"".join(read_chunks(response, deadline=deadline))
+            result = getattr(response, "code", 200), body, response.info()
+        finally:
+            response.close()
+        attrs["status"], attrs["bytes"] = result[0], len(result[1])
+        return result
+
+
+def read_chunks(response, size=CHUNK_SIZE, deadline=None):
+    """
+    Response body in chunks, reading stops with Cancelled once the deadline's lookup is aborted or out of time
+    """
+    if deadline is not None:
+        deadline.register(response)
+    try:
+        while True:
+            if deadline is not None:
+                deadline.check()
+            chunk = response.read(size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if deadline is not None:
+            deadline.unregister(response)
+
+
+def open_url(browser, url, log, timeout=30, deadline=None):
+    """
+    Download url through the shared per-host rate limiter, return the response body
+    """
+    return fetch(browser, url, log, timeout=timeout, deadline=deadline)[1]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from pickle import PicklingError
+
+from lxml import etree
+
+from calibre_plugins.databazeknihcz.deadline import Cancelled
+from calibre_plugins.databazeknihcz.executor import ABORT_CHECK_INTERVAL
+from calibre_plugins.databazeknihcz.extractor import extract, extract_header
+
+# Errors meaning the pool processes cannot run plugin code (plugin not importable there), parsing falls back
+# to the calling thread for the rest of the process
+POOL_ERRORS = (BrokenProcessPool, ImportError, PicklingError, OSError)
+# Seconds a page may take in the pool when the caller has no deadline, then it is parsed in the calling thread
+PARSE_TIMEOUT = 30
+
+
+def parse_book_page(raw):
+    """
+    Fields of a DK book page (or more info fragment) with the comments already converted to HTML,
+    None for the DK 404 page. Runs in a pool process, the result is a plain picklable record.
+    """
+    from calibre.library.comments import comments_to_html
+
+    root = etree.parse(BytesIO(raw), etree.HTMLParser())
+    header = extract_header(root)
+    if header and u"Stránka 404" in header[0]:
+        return None
+    record = extract(root)
+    if record.comments:
+        record = record._replace(comments_html=comments_to_html("\r\n".join(record.comments)))
+    return record
+
+
+def parse_search_page(provider, raw):
+    """
+    Candidates from a search results page of the provider, runs in a pool process
+    """
+    from calibre_plugins.databazeknihcz.search import PROVIDERS
+    return PROVIDERS[provider]().parse(raw)
+
+
+def plugin_loader():
+    """
+    Initializer of the pool processes - plugins are importable only after calibre loaded them
+    """
+    try:
+        from calibre.customize.ui import initialized_plugins
+    except ImportError:
+        return None
+    return initialized_plugins
+
+
+class ParsePool(object):
+    """
+    Optional process pool for HTML parsing and field extraction, so parsing of many concurrent lookups is not
+    limited to one core by the GIL. With no processes configured (the default) everything is parsed in the calling
+    thread. Experimental - spawned processes have to import the plugin, which is not verified for every calibre
+    build; when they cannot, parsing falls back to the calling thread.
+    """
+
+    def __init__(self):
+        self.processes = 0
+        self.executor = None
+        self.broken = False
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """
+        """
+        return self.processes > 0 and not self.broken
+
+    def configure(self, processes):
+        """
+        """
+        with self.lock:
+            if processes == self.processes:
+                return
+            executor, self.executor = self.executor, None
+            self.processes = processes
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def pool(self):
+        """
+        """
+        with self.lock:
+            if self.executor is None:
+                # Fresh processes - forking a process full of threads is not safe
+                self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                    mp_context=multiprocessing.get_context("spawn"),
+                                                    initializer=plugin_loader())
+            return self.executor
+
+    def run(self, fn, *args, deadline=None):
+        """
+        Result of fn(*args), computed in a pool process when the pool is enabled. The pool is waited for
+        while the deadline lasts, then the task is cancelled and Cancelled raised; without a deadline
+        a task not done in PARSE_TIMEOUT is cancelled and fn runs in the calling thread.
+        """
+        if not self.enabled:
+            return fn(*args)
+        try:
+            future = self.pool().submit(fn, *args)
+            if deadline is None:
+                return future.result(timeout=PARSE_TIMEOUT)
+            while True:
+                try:
+                    # Short waits, so an abort is noticed
+                    return future.result(timeout=min(ABORT_CHECK_INTERVAL, deadline.timeout()))
+                except TimeoutError:
+                    continue
+        except TimeoutError:
+            # Before POOL_ERRORS, TimeoutError is an OSError on newer Pythons
+            future.cancel()
+            return fn(*args)
+        except Cancelled:
+            future.cancel()
+            raise
+        except POOL_ERRORS:
+            self.broken = True
+            return fn(*args)
+
+
+_parse_pool = ParsePool()
+
+
+def get_parse_pool():
+    """
+    Process wide ParsePool instance
+    """
+    return _parse_pool
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import threading
+import time
+from calendar import timegm
+from email.utils import parsedate
+
+from calibre_plugins.databazeknihcz.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limits (
+    host TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    rate REAL NOT NULL,
+    blocked_until REAL NOT NULL,
+    strikes INTEGER NOT NULL,
+    throttled REAL NOT NULL
+);
+"""
+
+# Requests per second and bucket size for every host, other hosts use DEFAULT_RATE
+HOST_RATES = {
+    "www.google.cz": (0.2, 2),
+    "www.databazeknih.cz": (2.0, 4),
+    "html.duckduckgo.com": (0.5, 2),
+}
+DEFAULT_RATE = (1.0, 2)
+
+# Never slow down below this fraction of the configured rate
+MIN_RATE_FACTOR = 0.1
+# Rate recovery after every successful request
+RECOVERY_FACTOR = 1.1
+# Backoff after the first 429 / 503 without Retry-After, doubled with every next one
+BACKOFF = 30
+MAX_BACKOFF = 3600
+
+
+class RateLimited(Exception):
+    """
+    Host is blocked for longer than the caller is willing to wait
+    """
+
+    def __init__(self, host, wait):
+        Exception.__init__(self, "Rate limit for %s, next request possible in %.0f s" % (host, wait))
+        self.host = host
+        self.wait = wait
+
+
+def parse_retry_after(value):
+    """
+    Retry-After header value (seconds or HTTP date) to seconds from now
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed = parsedate(value)
+    if parsed is None:
+        return None
+    return max(0.0, timegm(parsed) - time.time())
+
+
+class RateLimiter(object):
+    """
+    Token bucket per host, shared by all threads and calibre job processes through the plugin storage.
+    Buckets slow down on HTTP 429 / 503 and honor Retry-After.
+    """
+
+    def __init__(self, storage, rates=None):
+        self.storage = storage
+        self.rates = HOST_RATES if rates is None else rates
+        self.storage.ensure_schema("rate_limits", SCHEMA)
+        self.lock = threading.Lock()
+        # Time spent waiting for tokens by this process, per host
+        self.throttled = {}
+
+    def limits(self, host):
+        """
+        """
+        return self.rates.get(host, DEFAULT_RATE)
+
+    def load(self, conn, host, now):
+        """
+        """
+        row = conn.execute("SELECT tokens, updated, rate, blocked_until, strikes FROM rate_limits WHERE host = ?",
+                           (host,)).fetchone()
+        if row is None:
+            rate, burst = self.limits(host)
+            return float(burst), now, rate, 0.0, 0
+        return row
+
+    def reserve(self, host):
+        """
+        Take one token if available, otherwise return seconds to wait for it
+        """
+        max_rate, burst = self.limits(host)
+        with self.storage.transaction() as conn:
+            now = time.time()
+            tokens, updated, rate, blocked_until, strikes = self.load(conn, host, now)
+            tokens = min(float(burst), tokens + max(0.0, now - updated) * rate)
+            if now < blocked_until:
+                wait = blocked_until - now
+            elif tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute("INSERT OR REPLACE INTO rate_limits (host, tokens, updated, rate, blocked_until, strikes, "
+                         "throttled) VALUES (?, ?, ?, ?, ?, ?, COALESCE((SELECT throttled FROM rate_limits "
+                         "WHERE host = ?), 0))", (host, tokens, now, rate, blocked_until, strikes, host))
+        return wait
+
+    def acquire(self, host, max_wait=None, deadline=None):
+        """
+        Block until a request to host is allowed, return time spent waiting.
+        Raise RateLimited when the host is blocked for longer than max_wait seconds,
+        waiting is interrupted (Cancelled) when the deadline's lookup is aborted.
+        """
+        waited = 0.0
+        try:
+            while True:
+                wait = self.reserve(host)
+                if not wait:
+                    break
+                if max_wait is not None and waited + wait > max_wait:
+                    raise RateLimited(host, wait)
+                if deadline is not None:
+                    deadline.sleep(wait)
+                else:
+                    time.sleep(wait)
+                waited += wait
+        finally:
+            self.record(host, waited)
+        return waited
+
+    def record(self, host, waited):
+        """
+        """
+        if not waited:
+            return
+        with self.lock:
+            self.throttled[host] = self.throttled.get(host, 0.0) + waited
+        self.storage.execute("UPDATE rate_limits SET throttled = throttled + ? WHERE host = ?", (waited, host))
+
+    def penalize(self, host, retry_after=None):
+        """
+        Host answered 429 / 503 - halve the rate and block it for Retry-After or an exponential backoff
+        """
+        max_rate, burst = self.limits(host)
+        with self.storage.transaction() as conn:
+            now = time.time()
+            tokens, updated, rate, blocked_until, strikes = self.load(conn, host, now)
+            if retry_after is None:
+                retry_after = min(MAX_BACKOFF, BACKOFF * 2 ** strikes)
+            rate = max(max_rate * MIN_RATE_FACTOR, rate / 2)
+            blocked_until = max(blocked_until, now + retry_after)
+            conn.execute("INSERT OR REPLACE INTO rate_limits (host, tokens, updated, rate, blocked_until, strikes, "
+                         "throttled) VALUES (?, 0, ?, ?, ?, ?, COALESCE((SELECT throttled FROM rate_limits "
+                         "WHERE host = ?), 0))", (host, now, rate, blocked_until, strikes + 1, host))
+        return retry_after
+
+    def reward(self, host):
+        """
+        Successful request - let the rate recover towards the configured maximum and forget one strike, a host
+        that keeps refusing between successes still backs off longer every time
+        """
+        max_rate, burst = self.limits(host)
+        self.storage.execute("UPDATE rate_limits SET rate = MIN(?, rate * ?), strikes = MAX(0, strikes - 1) "
+                             "WHERE host = ? AND (rate < ? OR strikes > 0)",
+                             (max_rate, RECOVERY_FACTOR, host, max_rate))
+
+    def throttled_time(self):
+        """
+        Total time this process spent waiting for any host
+        """
+        with self.lock:
+            return sum(self.throttled.values())
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Process wide RateLimiter instance
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(get_storage())
+        return _limiter
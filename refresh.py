@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import hashlib
+import json
+import time
+from collections import namedtuple
+
+from calibre_plugins.databazeknihcz.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS page_fingerprints (
+    databazeknih_id TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    digest TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    checked REAL NOT NULL
+);
+"""
+
+Fingerprint = namedtuple("Fingerprint", ["etag", "last_modified", "digest", "fields"])
+
+
+def record_digest(record, more_info=None):
+    """
+    Hash of the fields extracted from a book page and its more info fragment (ISBN, language) - ads, discussion
+    and recommendations around them change on every request, the fields do not
+    """
+    # Comments HTML depends on where the page was parsed, the comments themselves are in the record
+    records = [record._replace(comments_html=None)]
+    if more_info is not None:
+        records.append(more_info._replace(comments_html=None))
+    data = json.dumps([list(item) for item in records], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def validators(fingerprint):
+    """
+    Conditional request headers for a page fetched before
+    """
+    headers = {}
+    if fingerprint is not None and fingerprint.etag:
+        headers["If-None-Match"] = fingerprint.etag
+    if fingerprint is not None and fingerprint.last_modified:
+        headers["If-Modified-Since"] = fingerprint.last_modified
+    return headers
+
+
+def changed_fields(old, new):
+    """
+    Fields of new with a different value than in old, all of them for a book not refreshed before
+    """
+    if old is None:
+        return dict(new)
+    return dict((name, value) for name, value in new.items() if old.get(name) != value)
+
+
+class Fingerprints(object):
+    """
+    Validators and field digest of book pages refreshed before, with the metadata parsed from them
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.storage.ensure_schema("page_fingerprints", SCHEMA)
+
+    def get(self, databazeknih_id):
+        """
+        """
+        row = self.storage.execute("SELECT etag, last_modified, digest, fields FROM page_fingerprints "
+                                   "WHERE databazeknih_id = ?", (databazeknih_id,)).fetchone()
+        if row is None:
+            return None
+        return Fingerprint(row[0], row[1], row[2], json.loads(row[3]))
+
+    def put(self, databazeknih_id, etag, last_modified, digest, fields):
+        """
+        """
+        self.storage.execute("INSERT OR REPLACE INTO page_fingerprints (databazeknih_id, etag, last_modified, digest, "
+                             "fields, checked) VALUES (?, ?, ?, ?, ?, ?)",
+                             (databazeknih_id, etag, last_modified, digest, json.dumps(fields, ensure_ascii=False),
+                              time.time()))
+
+    def touch(self, databazeknih_id):
+        """
+        """
+        self.storage.execute("UPDATE page_fingerprints SET checked = ? WHERE databazeknih_id = ?",
+                             (time.time(), databazeknih_id))
+
+
+def get_fingerprints():
+    """
+    """
+    return Fingerprints(get_storage())
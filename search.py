@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import re
+from collections import namedtuple
+from io import BytesIO
+from urllib.parse import parse_qs, quote, urljoin, urlparse
+
+from html5_parser import parse
+from lxml import etree
+
+from calibre_plugins.databazeknihcz.matching import candidate_score
+from calibre_plugins.databazeknihcz.net import open_url
+from calibre_plugins.databazeknihcz.parsepool import get_parse_pool, parse_search_page
+
+BASE_URL = "https://www.databazeknih.cz/"
+
+# Book links on DK and in search results, both /knihy/ and /prehled-knihy/ lead to the same book
+BOOK_LINK = re.compile(r"^https?://www\.databazeknih\.cz/(?:knihy|prehled-knihy)/([^/?#]+-\d+)")
+
+
+def book_url(url):
+    """
+    Canonical DK book url (https://www.databazeknih.cz/knihy/<id>) or None for other links
+    """
+    match = BOOK_LINK.match(urljoin(BASE_URL, url))
+    if not match:
+        return None
+    return BASE_URL + "knihy/" + match.group(1)
+
+
+Candidate = namedtuple("Candidate", ["url", "text", "score"])
+
+
+class Blocked(Exception):
+    """
+    Provider answered with a captcha / bot check page instead of results
+    """
+
+    def __init__(self, provider):
+        Exception.__init__(self, "%s asks for a captcha" % provider)
+        self.provider = provider
+
+
+def unique_candidates(links):
+    """
+    Candidates from (href, text) pairs of search result links, first occurrence of every book wins
+    """
+    result = []
+    urls = set()
+    for href, text in links:
+        url = book_url(href)
+        if url and url not in urls:
+            urls.add(url)
+            result.append(Candidate(url, text, 0.0))
+    return result
+
+
+def rank(candidates, title, authors, limit):
+    """
+    Pre-score candidates against title / authors and return the best ones, best first
+    """
+    scored = [c._replace(score=candidate_score(title, authors, c.url, c.text)) for c in candidates]
+    # Stable sort - provider order decides between equal scores
+    scored.sort(key=lambda c: -c.score)
+    return scored[:limit]
+
+
+def query_words(*parts):
+    """
+    Query words joined by "+" and url encoded
+    """
+    words = " ".join(part for part in parts if part).replace("-", " ").split()
+    return quote("+".join(words).encode("utf8"), safe="+")
+
+
+class SearchProvider(object):
+    """
+    Finds DK book urls for a title / authors
+    """
+    name = None
+    # Bytes of a captcha / bot check page
+    CAPTCHA_MARKERS = ()
+
+    def search(self, browser, log, title, authors, timeout=30, deadline=None):
+        """
+        Return list of Candidates in provider order
+        """
+        raise NotImplementedError()
+
+    def results(self, raw, deadline=None):
+        """
+        Candidates from a results page, parsed in the parse pool when it is enabled
+        """
+        self.check(raw)
+        pool = get_parse_pool()
+        if not pool.enabled:
+            return self.parse(raw)
+        return pool.run(parse_search_page, self.name, raw, deadline=deadline)
+
+    def check(self, raw):
+        """
+        Raise Blocked for a captcha page, it would parse as a page with no results
+        """
+        for marker in self.CAPTCHA_MARKERS:
+            if marker in raw:
+                raise Blocked(self.name)
+
+
+class GoogleSearch(SearchProvider):
+    """
+    Google search restricted to databazeknih.cz
+    """
+    name = "google"
+    SEARCH_URL = "https://www.google.cz/search?q=site:databazeknih.cz/knihy%20"
+    CAPTCHA_MARKERS = (b"captcha-form", b"g-recaptcha", b"/sorry/index")
+
+    def search(self, browser, log, title, authors, timeout=30, deadline=None):
+        """
+        """
+        if not title:
+            return []
+        search_url = self.SEARCH_URL + query_words(title, authors[0] if authors else None)
+        log.info("Google search URL: %r" % search_url)
+        raw = open_url(browser, search_url, log, timeout=timeout, deadline=deadline).strip()
+        return self.results(raw, deadline)
+
+    def parse(self, raw):
+        """
+        """
+        root = parse(raw)
+        nodes = root.xpath("(//div[contains(@class, 'g')])//a")
+        # Result block holds the page title and snippet
+        return unique_candidates((node.get("href", "#"), node.getparent().xpath("string()")) for node in nodes
+                                 if node.get("href", "#") != "#")
+
+
+class DatabazeKnihSearch(SearchProvider):
+    """
+    Search page of databazeknih.cz itself
+    """
+    name = "databazeknih"
+    SEARCH_URL = BASE_URL + "search?hledat=&stranka=search&q="
+    RESULT_LINKS = etree.XPath("//a[contains(@href, 'knihy/')]")
+
+    def search(self, browser, log, title, authors, timeout=30, deadline=None):
+        """
+        """
+        if not title:
+            return []
+        search_url = self.SEARCH_URL + query_words(title)
+        log.info("DK search URL: %r" % search_url)
+        raw = open_url(browser, search_url, log, timeout=timeout, deadline=deadline)
+        return self.results(raw, deadline)
+
+    def parse(self, raw):
+        """
+        """
+        root = etree.parse(BytesIO(raw), etree.HTMLParser())
+        # Parent of the link holds the title together with authors and year
+        return unique_candidates((node.get("href"), node.getparent().xpath("string()"))
+                                 for node in self.RESULT_LINKS(root))
+
+
+class DuckDuckGoSearch(SearchProvider):
+    """
+    HTML version of DuckDuckGo restricted to databazeknih.cz, no scripts needed
+    """
+    name = "duckduckgo"
+    SEARCH_URL = "https://html.duckduckgo.com/html/?q=site:databazeknih.cz/knihy+"
+    CAPTCHA_MARKERS = (b"anomaly-modal", b"challenge-form")
+    RESULT_LINKS = etree.XPath("//a[contains(@class, 'result__a')]")
+    RESULT_BODY = etree.XPath("ancestor::div[contains(@class, 'result__body')][1]")
+
+    def search(self, browser, log, title, authors, timeout=30, deadline=None):
+        """
+        """
+        if not title:
+            return []
+        search_url = self.SEARCH_URL + query_words(title, authors[0] if authors else None)
+        log.info("DuckDuckGo search URL: %r" % search_url)
+        raw = open_url(browser, search_url, log, timeout=timeout, deadline=deadline)
+        return self.results(raw, deadline)
+
+    def parse(self, raw):
+        """
+        """
+        root = etree.parse(BytesIO(raw), etree.HTMLParser())
+        links = []
+        for node in self.RESULT_LINKS(root):
+            body = self.RESULT_BODY(node)
+            # Title and snippet of the result
+            text = " ".join(t.strip() for t in (body[0] if body else node).xpath(".//text()") if t.strip())
+            links.append((self.target(node.get("href", "")), text))
+        return unique_candidates(links)
+
+    def target(self, href):
+        """
+        Result url, links usually go through the DuckDuckGo redirect (/l/?uddg=<url>)
+        """
+        uddg = parse_qs(urlparse(href).query).get("uddg")
+        return uddg[0] if uddg else href
+
+
+PROVIDERS = {
+    GoogleSearch.name: GoogleSearch,
+    DatabazeKnihSearch.name: DatabazeKnihSearch,
+    DuckDuckGoSearch.name: DuckDuckGoSearch,
+}
+
+
+def search_providers(backend):
+    """
+    Configured search backend followed by the other ones as fallback
+    """
+    names = [backend] + sorted(name for name in PROVIDERS if name != backend)
+    return [PROVIDERS[name]() for name in names if name in PROVIDERS]
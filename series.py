@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import re
+from collections import namedtuple
+
+from lxml import etree
+
+from calibre_plugins.databazeknihcz.booklist import BookListIndex, page_url, parse_book_list
+from calibre_plugins.databazeknihcz.matching import fold
+from calibre_plugins.databazeknihcz.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series_pages (
+    series_url TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    fetched REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS series_volumes (
+    series_url TEXT NOT NULL,
+    databazeknih_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    folded_title TEXT NOT NULL,
+    series_index REAL,
+    PRIMARY KEY (series_url, databazeknih_id)
+);
+CREATE INDEX IF NOT EXISTS series_volumes_title ON series_volumes (folded_title);
+CREATE INDEX IF NOT EXISTS series_volumes_id ON series_volumes (databazeknih_id);
+"""
+
+# Series pages are fetched again after this many seconds
+SERIES_MAX_AGE = 30 * 24 * 3600
+
+SERIES_LINK = re.compile(r"^https?://www\.databazeknih\.cz/serie/[^/?#]+")
+# Volume number in the first cell of the volume's row (or in front of the title), e.g. "3." or "2,5."
+VOLUME_NUMBER = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s*\.")
+
+ROW_NUMBER = etree.XPath("string(ancestor::tr[1]/td[1])")
+
+Volume = namedtuple("Volume", ["databazeknih_id", "title", "series_index"])
+
+
+def series_url(url):
+    """
+    Absolute DK series url or None for other links
+    """
+    return page_url(SERIES_LINK, url)
+
+
+def volume_number(text):
+    """
+    """
+    match = VOLUME_NUMBER.match(text or "")
+    if not match:
+        return None
+    return float(match.group(1).replace(",", "."))
+
+
+def parse_series_page(raw):
+    """
+    Series name and its volumes in series order from a DK series page. Volume number comes from the list
+    itself - DK numbers volumes 0,5, omnibuses and gaps too, so a volume without a number has index None.
+    """
+    name, books = parse_book_list(raw)
+    volumes = []
+    for databazeknih_id, title, node in books:
+        index = volume_number(ROW_NUMBER(node))
+        if index is None and node.getparent() is not None:
+            # List without a table, "3. Title"
+            index = volume_number(node.getparent().xpath("string()"))
+        volumes.append(Volume(databazeknih_id, title, index))
+    return name, volumes
+
+
+class SeriesIndex(BookListIndex):
+    """
+    Volumes of series pages fetched before - DK id of a title without searching and authoritative series index
+    """
+    PAGES = "series_pages"
+    BOOKS = "series_volumes"
+    URL = "series_url"
+
+    def __init__(self, storage):
+        BookListIndex.__init__(self, storage, "series", SCHEMA)
+
+    def book_values(self, volume):
+        """
+        """
+        return {"databazeknih_id": volume.databazeknih_id, "title": volume.title, "folded_title": fold(volume.title),
+                "series_index": volume.series_index}
+
+    def volume(self, databazeknih_id):
+        """
+        (series name, series index) of a book or None
+        """
+        row = self.storage.execute("SELECT p.name, v.series_index FROM series_volumes v JOIN series_pages p "
+                                   "ON p.series_url = v.series_url WHERE v.databazeknih_id = ?",
+                                   (databazeknih_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def find(self, title):
+        """
+        DK id of the only volume with exactly this title (ignoring case and diacritics) or None
+        """
+        rows = self.storage.execute("SELECT DISTINCT databazeknih_id FROM series_volumes WHERE folded_title = ?",
+                                    (fold(title),)).fetchall()
+        return rows[0][0] if len(rows) == 1 else None
+
+
+def get_series_index():
+    """
+    """
+    return SeriesIndex(get_storage())
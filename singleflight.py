@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import os
+import threading
+import time
+
+from calibre_plugins.databazeknihcz.storage import get_storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inflight (
+    key TEXT PRIMARY KEY,
+    owner INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+# How often a caller waiting for another process looks whether its claim was released (seconds)
+POLL_INTERVAL = 0.2
+# Claim of another process is taken over after this long, the process may have died (seconds),
+# a running call in this process is waited for at most this long as well
+LEASE = 60
+
+
+def pause(deadline=None):
+    """
+    """
+    if deadline is not None:
+        deadline.sleep(POLL_INTERVAL)
+    else:
+        time.sleep(POLL_INTERVAL)
+
+
+class Flight(object):
+    """
+    One running call, waited for by the later callers with the same key
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+        # Leader's lookup stopped during the call, its result may be empty for that reason only
+        self.cancelled = False
+
+
+class SingleFlight(object):
+    """
+    Runs one call per key at a time. Callers in this process share the result of the running call,
+    callers in other calibre processes wait for it (claims are kept in the plugin storage) and then
+    find its result in the persistent caches.
+    """
+
+    def __init__(self, storage=None):
+        self._storage = storage
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.counters = {"local": 0, "shared": 0}
+
+    @property
+    def storage(self):
+        """
+        Plugin storage, opened only when a call is shared with other processes
+        """
+        if self._storage is None:
+            self._storage = get_storage()
+        self._storage.ensure_schema("inflight", SCHEMA)
+        return self._storage
+
+    def run(self, key, fn, deadline=None, shared=False):
+        """
+        Result of fn for key. With shared the call also waits for the same key in other processes,
+        fn has to read the persistent cache the other process fills then.
+        """
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = Flight()
+            if leader:
+                break
+            if not self.wait(flight, deadline):
+                # Running call takes too long, try on our own
+                return fn()
+            if not flight.failed and not flight.cancelled:
+                self.count("local")
+                return flight.result
+            # Running call failed or its lookup stopped, the first waiter with time left runs it again,
+            # reading what the call managed to cache
+            if deadline is not None:
+                deadline.check()
+
+        try:
+            if shared and self.claim(key, deadline):
+                self.count("shared")
+            try:
+                flight.result = fn()
+            finally:
+                if shared:
+                    self.release(key)
+            flight.cancelled = deadline is not None and deadline.expired()
+            return flight.result
+        except BaseException:
+            flight.failed = True
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def wait(self, flight, deadline=None, limit=LEASE):
+        """
+        Block until the running call finishes, at most limit seconds and the deadline's remaining time.
+        Return whether it finished, Cancelled is raised when the deadline's lookup stops meanwhile.
+        """
+        timeout = limit if deadline is None else min(limit, deadline.remaining())
+        finished = flight.done.wait(timeout)
+        if deadline is not None and not finished:
+            deadline.check()
+        return finished
+
+    def try_claim(self, key):
+        """
+        """
+        with self.storage.transaction() as conn:
+            now = time.time()
+            row = conn.execute("SELECT expires FROM inflight WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO inflight (key, owner, expires) VALUES (?, ?, ?)",
+                         (key, os.getpid(), now + LEASE))
+            return True
+
+    def claim(self, key, deadline=None):
+        """
+        Claim key for this process, return True if another process had to be waited for
+        """
+        if self.try_claim(key):
+            return False
+        start = time.time()
+        while not self.try_claim(key):
+            if time.time() - start > LEASE:
+                # Lease was renewed meanwhile, the other process is stuck - go on without the claim
+                break
+            pause(deadline)
+        return True
+
+    def release(self, key):
+        """
+        """
+        self.storage.execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, os.getpid()))
+
+    def count(self, name):
+        """
+        """
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        """
+        Calls that waited for a running call in this process (local) or in another process (shared)
+        """
+        with self.lock:
+            return dict(self.counters)
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """
+    Process wide SingleFlight instance
+    """
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from calibre.constants import cache_dir
+
+DB_NAME = "databazeknihcz.sqlite"
+
+
+def storage_dir():
+    """
+    Directory with the on-disk state of the plugin, shared by all calibre processes
+    """
+    path = os.path.join(cache_dir(), "databazeknihcz")
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+class Storage(object):
+    """
+    SQLite database (WAL mode) shared by all threads and calibre job processes.
+    Every thread gets its own connection, cross-process locking is left to SQLite.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.schemas = set()
+        self.lock = threading.Lock()
+
+    def connection(self):
+        """
+        """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def ensure_schema(self, name, sql):
+        """
+        Create tables of the module `name` once per process
+        """
+        with self.lock:
+            if name in self.schemas:
+                return
+            self.connection().executescript(sql)
+            self.schemas.add(name)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Write transaction, the database lock is taken immediately so concurrent writers queue up
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def execute(self, sql, params=()):
+        """
+        """
+        return self.connection().execute(sql, params)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """
+    Process wide Storage instance
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = Storage(os.path.join(storage_dir(), DB_NAME))
+        return _storage
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import io
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from calibre_plugins.databazeknihcz.storage import storage_dir
+
+_lookup_ids = itertools.count(1)
+# Lookups finishing at the same time append to the same file
+_write_lock = threading.Lock()
+
+
+def new_lookup_id():
+    """
+    Id of one identify / download_cover call, unique within the process
+    """
+    return "%d-%d" % (os.getpid(), next(_lookup_ids))
+
+
+class Tracer(object):
+    """
+    Collects timed spans (search, fetch, parse, throttle, ...) of lookups.
+    Disabled tracer costs one attribute check per span.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        # Set by the batch command, keeps tracing on whatever the config says
+        self.force = False
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def lookup(self, lookup_id):
+        """
+        Spans recorded by this thread belong to lookup_id
+        """
+        previous = getattr(self.local, "lookup", None)
+        self.local.lookup = lookup_id
+        try:
+            yield
+        finally:
+            self.local.lookup = previous
+
+    def current_lookup(self):
+        """
+        """
+        return getattr(self.local, "lookup", None)
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Time the block, the yielded dict can be filled with more attributes (bytes, status, ...)
+        """
+        if not self.enabled:
+            yield attrs
+            return
+        start = time.time()
+        try:
+            yield attrs
+        finally:
+            self.add(name, start, time.time() - start, attrs)
+
+    def add(self, name, start, duration, attrs=None):
+        """
+        Record a span measured elsewhere
+        """
+        if not self.enabled:
+            return
+        span = {
+            "name": name,
+            "lookup": self.current_lookup(),
+            "thread": threading.current_thread().name,
+            "start": start,
+            "duration": duration,
+            "attrs": attrs or {},
+        }
+        with self.lock:
+            self.spans.append(span)
+
+    def take(self, lookup_id=None):
+        """
+        Remove and return recorded spans, all or of one lookup
+        """
+        with self.lock:
+            if lookup_id is None:
+                spans, self.spans = self.spans, []
+            else:
+                spans = [s for s in self.spans if s["lookup"] == lookup_id]
+                self.spans = [s for s in self.spans if s["lookup"] != lookup_id]
+        return spans
+
+
+def traced(name):
+    """
+    Method decorator recording a span for every call
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            with _tracer.span(name):
+                return method(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_dir():
+    """
+    """
+    path = os.path.join(storage_dir(), "traces")
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def append_jsonl(path, spans):
+    """
+    """
+    data = "".join(json.dumps(span, ensure_ascii=False) + "\n" for span in spans)
+    with _write_lock, io.open(path, "a", encoding="utf-8") as f:
+        f.write(data)
+
+
+def read_jsonl(paths):
+    """
+    """
+    spans = []
+    for path in paths:
+        with io.open(path, "r", encoding="utf-8") as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+
+def chrome_trace(spans):
+    """
+    Spans in Chrome trace event format (chrome://tracing, Perfetto), one row per thread
+    """
+    events = []
+    for span in spans:
+        args = dict(span["attrs"])
+        args["lookup"] = span["lookup"]
+        events.append({
+            "name": span["name"],
+            "cat": span["name"].split("_")[0],
+            "ph": "X",
+            "ts": int(span["start"] * 1e6),
+            "dur": int(span["duration"] * 1e6),
+            "pid": int(str(span["lookup"]).split("-")[0]) if span["lookup"] else 0,
+            "tid": span["thread"],
+            "args": args,
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def percentile(values, fraction):
+    """
+    """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def summary(spans):
+    """
+    Count, total, p50 and p95 duration (seconds) of every span name
+    """
+    durations = {}
+    for span in spans:
+        durations.setdefault(span["name"], []).append(span["duration"])
+    return dict((name, {
+        "count": len(values),
+        "total": sum(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+    }) for name, values in durations.items())
+
+
+def format_summary(stats):
+    """
+    """
+    lines = ["%-24s %8s %10s %10s %10s" % ("span", "count", "total s", "p50 ms", "p95 ms")]
+    for name, s in sorted(stats.items(), key=lambda item: -item[1]["total"]):
+        lines.append("%-24s %8d %10.2f %10.1f %10.1f" % (name, s["count"], s["total"], 1000 * s["p50"],
+                                                          1000 * s["p95"]))
+    return "\n".join(lines)
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    """
+    Process wide Tracer instance
+    """
+    return _tracer
+
+
+def add_arguments(parser):
+    """
+    """
+    parser.add_argument("files", nargs="*", help="Trace JSONL files, default all files in the plugin trace dir")
+    parser.add_argument("--chrome", default=None, help="Write Chrome trace JSON to this file")
+
+
+def run(plugin, opts):
+    """
+    Summarize recorded traces, optionally convert them to Chrome trace format
+    """
+    files = opts.files or [os.path.join(trace_dir(), name) for name in sorted(os.listdir(trace_dir()))
+                           if name.endswith(".jsonl")]
+    spans = read_jsonl(files)
+    print(format_summary(summary(spans)))
+    if opts.chrome:
+        with io.open(opts.chrome, "w", encoding="utf-8") as f:
+            f.write(json.dumps(chrome_trace(spans)))
+        print("Chrome trace written to %s" % opts.chrome)
+    return 0
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import (unicode_literals, division, absolute_import, print_function)
+
+__license__ = "GPL v3"
+__copyright__ = "2021, Tomas Vecera <tomas@vecera.dev>"
+__docformat__ = "restructuredtext cs"
+
+import http.client
+import ssl
+import threading
+import time
+import zlib
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPT_ENCODING = "gzip, br" if brotli is not None else "gzip"
+# Idle connections kept per host
+MAX_IDLE = 8
+# Servers drop idle keep-alive connections after a while, older ones are not reused
+IDLE_TIMEOUT = 15
+MAX_REDIRECTS = 5
+# Read size when the whole body is read at once
+READ_SIZE = 64 * 1024
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# Errors of a reused connection the server already closed, the request is repeated on a new one
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+
+def decoder(encoding):
+    """
+    Incremental decompressor for a Content-Encoding, None for identity
+    """
+    encoding = (encoding or "").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "br" and brotli is not None:
+        return BrotliDecoder()
+    return None
+
+
+class BrotliDecoder(object):
+    """
+    zlib like interface over the brotli decompressor (process() in brotli, decompress() in brotlicffi)
+    """
+
+    def __init__(self):
+        decompressor = brotli.Decompressor()
+        self.process = getattr(decompressor, "process", None) or decompressor.decompress
+
+    def decompress(self, data):
+        """
+        """
+        return self.process(data)
+
+    def flush(self):
+        """
+        """
+        return b""
+
+
+class HostPool(object):
+    """
+    Idle keep-alive connections to one host
+    """
+
+    def __init__(self, scheme, host, port, context):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.context = context
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Idle connection or None
+        """
+        now = time.time()
+        with self.lock:
+            while self.idle:
+                conn, released = self.idle.pop()
+                if now - released < IDLE_TIMEOUT:
+                    return conn
+                conn.close()
+        return None
+
+    def new(self, timeout):
+        """
+        """
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout, context=self.context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def release(self, conn):
+        """
+        """
+        with self.lock:
+            if len(self.idle) < MAX_IDLE:
+                self.idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        """
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, released in idle:
+            conn.close()
+
+
+class Response(object):
+    """
+    Decompressed response body, the connection goes back to the pool once the body is read and closed
+    """
+
+    def __init__(self, transport, pool, conn, raw, url):
+        self.transport = transport
+        self.pool = pool
+        self.conn = conn
+        self.raw = raw
+        self.url = url
+        self.code = raw.status
+        self.msg = raw.reason
+        self.headers = raw.msg
+        self.decoder = decoder(raw.getheader("Content-Encoding"))
+        self.eof = False
+
+    def info(self):
+        """
+        """
+        return self.headers
+
+    def geturl(self):
+        """
+        """
+        return self.url
+
+    def getcode(self):
+        """
+        """
+        return self.code
+
+    def read(self, size=-1):
+        """
+        Up to about size bytes of the decoded body, b"" at the end
+        """
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(READ_SIZE), b""))
+        while not self.eof:
+            chunk = self.raw.read(size)
+            if not chunk:
+                self.eof = True
+                data = self.decoder.flush() if self.decoder is not None else b""
+            else:
+                data = self.decoder.decompress(chunk) if self.decoder is not None else chunk
+            self.transport.count(wire=len(chunk), body=len(data))
+            if data:
+                return data
+        return b""
+
+    def close(self):
+        """
+        """
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        # Connection with an unread body (streamed page cut short) cannot be reused
+        if self.raw.isclosed() and not self.raw.will_close:
+            self.pool.release(conn)
+        else:
+            self.raw.close()
+            conn.close()
+
+
+class Transport(object):
+    """
+    Keep-alive connection pools per host with gzip / brotli, shared by all threads of the process
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.context = ssl.create_default_context()
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.counters = {"opened": 0, "reused": 0, "wire_bytes": 0, "body_bytes": 0}
+
+    def count(self, opened=0, reused=0, wire=0, body=0):
+        """
+        """
+        with self.lock:
+            self.counters["opened"] += opened
+            self.counters["reused"] += reused
+            self.counters["wire_bytes"] += wire
+            self.counters["body_bytes"] += body
+
+    def stats(self):
+        """
+        Connections opened / reused and bytes on the wire / after decompression since the process started
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def pool(self, scheme, host, port):
+        """
+        """
+        key = (scheme, host, port)
+        with self.lock:
+            if key not in self.pools:
+                self.pools[key] = HostPool(scheme, host, port, self.context)
+            return self.pools[key]
+
+    def request(self, url, headers, timeout):
+        """
+        Send GET on a pooled connection, a stale reused connection is replaced once
+        """
+        parts = urlparse(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        pool = self.pool(parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        conn = pool.get()
+        while True:
+            reused = conn is not None
+            if not reused:
+                conn = pool.new(timeout)
+            else:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+            try:
+                conn.request("GET", path, headers=headers)
+                raw = conn.getresponse()
+            except STALE_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                conn = None
+                continue
+            except:
+                conn.close()
+                raise
+            self.count(opened=int(not reused), reused=int(reused))
+            return Response(self, pool, conn, raw, url)
+
+    def open(self, url, headers=None, timeout=30):
+        """
+        Response for url with redirects followed, HTTP errors (and 304) raise HTTPError
+        """
+        request_headers = {"Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"}
+        request_headers.update(headers or {})
+        for i in range(MAX_REDIRECTS + 1):
+            response = self.request(url, request_headers, timeout)
+            if response.code in REDIRECT_CODES and response.headers.get("Location"):
+                response.read()
+                response.close()
+                url = urljoin(url, response.headers["Location"])
+                continue
+            if response.code >= 300:
+                response.read()
+                response.close()
+                raise HTTPError(url, response.code, response.msg, response.headers, None)
+            return response
+        raise HTTPError(url, response.code, "Too many redirects", response.headers, None)
+
+    def clear(self):
+        """
+        """
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            pool.clear()
+
+
+_transport = Transport()
+
+
+def get_transport():
+    """
+    Process wide Transport instance
+    """
+    return _transport
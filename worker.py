@@ -8,8 +8,10 @@ __docformat__ = "restructuredtext cs"
 
 import re
 import socket
+import threading
+from contextlib import closing
 from datetime import datetime
-from threading import Thread
+from io import BytesIO
 
 from calibre.utils.date import parse_date
 from calibre.ebooks.metadata import check_isbn
@@ -17,18 +19,71 @@ from calibre.ebooks.metadata.book.base import Metadata
 from calibre.library.comments import comments_to_html
 from lxml import etree
 
+from calibre_plugins.databazeknihcz.bibliography import AUTHOR_MAX_AGE, author_url, get_bibliography, parse_author_page
+from calibre_plugins.databazeknihcz.cache import get_response_cache
+from calibre_plugins.databazeknihcz.deadline import Cancelled, Deadline
+from calibre_plugins.databazeknihcz.executor import result_inline
+from calibre_plugins.databazeknihcz.extractor import (COVER_MARKERS, PAGE_MARKERS, IncrementalParser, extract,
+                                                      extract_header)
+from calibre_plugins.databazeknihcz.fetchplan import FULL_PLAN
+from calibre_plugins.databazeknihcz.matching import CONFIDENCE, metadata_score
+from calibre_plugins.databazeknihcz.net import NOT_MODIFIED, error_code, fetch, open_response, open_url, read_chunks
+from calibre_plugins.databazeknihcz.parsepool import get_parse_pool, parse_book_page
+from calibre_plugins.databazeknihcz.ratelimit import RateLimited
+from calibre_plugins.databazeknihcz.refresh import changed_fields, get_fingerprints, record_digest, validators
+from calibre_plugins.databazeknihcz.search import book_url
+from calibre_plugins.databazeknihcz.series import SERIES_MAX_AGE, get_series_index, parse_series_page, series_url
+from calibre_plugins.databazeknihcz.singleflight import get_single_flight
+from calibre_plugins.databazeknihcz.tracing import get_tracer, traced
+
+
+def metadata_to_dict(mi):
+    """
+    JSON friendly view of parsed Metadata
+    """
+    if mi is None:
+        return None
+    return {
+        "title": mi.title,
+        "authors": list(mi.authors),
+        "series": mi.series,
+        "series_index": mi.series_index,
+        "publisher": mi.publisher,
+        "pubdate": mi.pubdate.isoformat() if mi.pubdate else None,
+        "tags": list(mi.tags),
+        "rating": mi.rating,
+        "isbn": mi.isbn,
+        "languages": list(mi.languages),
+        "comments": mi.comments,
+        "identifiers": dict(mi.identifiers),
+        "has_cover": bool(mi.has_cover),
+    }
+
+
+def complete_page(raw):
+    """
+    Does raw end like a whole html page, a page cut short while streaming does not
+    """
+    return raw.rstrip().lower().endswith(b"</html>")
 
-class Worker(Thread):
+
+def partial_key(url):
     """
-    Get book details from databazeknih.cz (DK) book page in a separate thread
+    Response cache key of a page read only until the fields of a fetch plan were complete
     """
+    return url + "#partial"
+
 
-    def __init__(self, url, result_queue, browser, log, relevance, plugin, timeout=20):
-        Thread.__init__(self)
+class Worker(object):
+    """
+    Get book details from databazeknih.cz (DK) book page, run as a task of the shared executor
+    """
+
+    def __init__(self, url, result_queue, browser, log, relevance, plugin, executor, query=None, found=None,
+                 lookup=None, deadline=None, plan=None, timeout=20):
         self.title = None
         self.isbn = None
         self.databazeknih_id = None
-        self.daemon = True
         self.url = url
         self.result_queue = result_queue
         self.log = log
@@ -36,7 +91,18 @@ class Worker(Thread):
         self.timeout = timeout
         self.relevance = relevance
         self.plugin = plugin
-        self.browser = browser.clone_browser()
+        self.executor = executor
+        self.query = query
+        self.found = found
+        self.lookup = lookup
+        # Budget shared with the other requests of the lookup, own one for workers run alone
+        self.deadline = deadline if deadline is not None else Deadline(timeout)
+        self.plan = plan if plan is not None else FULL_PLAN
+        # Every thread working for this worker (page, more info task) gets its own clone, see browser
+        self.base_browser = browser.clone_browser()
+        self.browsers = threading.local()
+        self.browser_lock = threading.Lock()
+        self.cache = get_response_cache(plugin)
         self.cover_url = None
         self.authors = []
         self.comments = None
@@ -47,6 +113,11 @@ class Worker(Thread):
         self.tags = []
         self.rating = 0
         self.more_info = None
+        self.more_url = None
+        self.more_info_future = None
+        # Page could not be fetched for another reason than not existing on DK, the lookup is inconclusive
+        self.failed = False
+        self.not_found = False
         self.lang_map = {}
 
         # Mapping language to something calibre understand. Just used in this plugin
@@ -58,126 +129,454 @@ class Worker(Thread):
             for name in names:
                 self.lang_map[name] = code
 
+    @property
+    def browser(self):
+        """
+        Browser of the calling thread - mechanize browsers are not thread safe, and series / author pages
+        are downloaded while the more info task may be running
+        """
+        browser = getattr(self.browsers, "browser", None)
+        if browser is None:
+            with self.browser_lock:
+                browser = self.browsers.browser = self.base_browser.clone_browser()
+        return browser
+
+    def debug(self, msg, *args):
+        """
+        Verbose logging, the message is formatted only when verbose logging is enabled
+        """
+        if self.plugin.cfg_verbose_loging:
+            self.log.info(msg % args if args else msg)
+
     def run(self):
         """
         """
-        self.log.info("    Worker.run: self: ", self)
-        try:
-            self.get_details()
-        except:
-            self.log.exception("get_details() failed for url: %r" % self.url)
+        with get_tracer().lookup(self.lookup):
+            self.debug("    Worker.run: self: %s", self)
+            try:
+                self.get_details()
+            except:
+                self.log.exception("get_details() failed for url: %r" % self.url)
 
     def get_details(self):
         """
         """
-        self.log.info("    Worker.get_details:")
-        self.log.info("        self:     ", self)
-        self.log.info("        self.url: ", self.url)
+        self.debug("    Worker.get_details:")
+        self.debug("        self:     %s", self)
+        self.debug("        self.url: %s", self.url)
 
-        root = self.fetch_url(self.url)
-        if not root:
+        if self.found is not None and self.found.is_set():
+            self.debug("        Better candidate already found, skipping: %r", self.url)
+            return
+        if self.deadline.expired():
+            self.debug("        Lookup cancelled, skipping: %r", self.url)
+            return
+
+        record = self.fetch_record(self.url, self.plan.markers)
+        if record is None:
+            if self.deadline.expired():
+                return
+            self.failed = not self.not_found
             self.log.exception("Cannot fetch / parse DK metadata for %r." % self.url)
             return
 
-        self.more_info = self.fetch_more(root)
+        # More info is downloaded by another task while the main page is parsed
+        self.more_url = self.more_info_url(record) if self.plan.more_info else None
+        if self.more_url:
+            try:
+                self.more_info_future = self.executor.submit(self.fetch_more_info, self.more_url)
+            except RuntimeError:
+                # Executor was replaced after a config change, more info is fetched inline
+                self.more_info_future = None
 
-        self.parse_details(root)
+        self.parse_details(record)
 
-    def fetch_url(self, url):
+    def fetch_cover_url(self):
         """
+        Cover url of an identified book, no more info request and no parsing of other fields
         """
+        record = self.fetch_record(self.url, COVER_MARKERS)
+        if record is None or not record.cover:
+            return None
+        self.databazeknih_id = self.parse_databazeknih_id(self.url)
+        self.cover_url = record.cover[0]
+        self.plugin.cache_identifier_to_cover_url(self.databazeknih_id, self.cover_url)
+        self.debug("        Parsed URL for cover: %r", self.cover_url)
+        return self.cover_url
+
+    def refresh(self):
+        """
+        Refresh a book parsed before. The page is requested with the validators of the last refresh, and
+        fields are parsed (and the result emitted) only when the page or the fields on it changed.
+        Return the changed fields, {} for an unchanged book, None when the page or its more info fragment
+        could not be fetched.
+        """
+        self.databazeknih_id = self.parse_databazeknih_id(self.url)
+        fingerprints = get_fingerprints()
+        old = fingerprints.get(self.databazeknih_id)
         try:
-            self.log.info("        Fetch data for url: %r" % url)
-            html = self.browser.open_novisit(url, timeout=self.timeout)
+            self.debug("        Refresh data for url: %r", self.url)
+            status, raw, headers = fetch(self.browser, self.url, self.log, timeout=self.request_timeout(),
+                                         headers=validators(old) or None, deadline=self.deadline)
+        except RateLimited as e:
+            self.log.error("DK metadata for %r not fetched: %s" % (self.url, e))
+            return None
+        except Cancelled as e:
+            self.log.info("DK metadata for %r not fetched: %s" % (self.url, e))
+            return None
         except Exception as e:
-            if callable(getattr(e, "getcode", None)) and e.getcode() == 404:
-                self.log.exception("URL malformed: %r" % url)
-                return
-            attr = getattr(e, "args", [None])
-            attr = attr if attr else [None]
-            if isinstance(attr[0], socket.timeout):
-                self.log.exception("DK metadata for %r timed out. Try again later." % url)
-            else:
-                self.log.exception("Failed to make details query: %r" % url)
-            return
+            self.report_error(self.url, e)
+            return None
+
+        if status == NOT_MODIFIED and old is not None:
+            self.log.info("Not modified: %r" % self.url)
+            fingerprints.touch(self.databazeknih_id)
+            return {}
+        if not raw:
+            return None
+        # Later lookups of the book read the fresh page
+        if self.cache is not None:
+            self.cache.put(self.url, raw)
+        root = self.parse_page(self.url, raw)
+        if root is None:
+            return None
+        with get_tracer().span("extract"):
+            record = extract(root)
+        etag = headers.get("ETag") if headers is not None else None
+        last_modified = headers.get("Last-Modified") if headers is not None else None
+        self.more_url = self.more_info_url(record) if self.plan.more_info else None
+        self.more_info = self.fetch_more()
+        if self.more_url and self.more_info is None:
+            # Fields of a more info fragment not fetched are not taken as removed
+            return None
+        digest = record_digest(record, self.more_info)
+        if old is not None and old.digest == digest:
+            self.log.info("Fields not changed: %r" % self.url)
+            fingerprints.put(self.databazeknih_id, etag, last_modified, digest, old.fields)
+            return {}
+
+        mi = self.parse_details(record)
+        if mi is None:
+            return None
+        fields = metadata_to_dict(mi)
+        fingerprints.put(self.databazeknih_id, etag, last_modified, digest, fields)
+        return changed_fields(old.fields if old is not None else None, fields)
+
+    def fetch_record(self, url, markers=None):
+        """
+        Fetch url and extract all DK fields, the parsed tree is dropped right away.
+        With markers the page is parsed while downloading and only read until all marked fields are complete.
+        Concurrent lookups of the same page (the same book in more formats, cover download after identify)
+        share one download, other processes wait for it and read the page from the response cache.
+        """
+        try:
+            # Page read for fewer fields is not shared with lookups that need more of it
+            key = url if not markers or markers == PAGE_MARKERS else "%s#%s" % (url, ",".join(sorted(markers)))
+            return get_single_flight().run(key, lambda: self.load_record(url, markers), self.deadline,
+                                           shared=self.cache is not None)
+        except Cancelled as e:
+            self.log.info("DK metadata for %r not fetched: %s" % (url, e))
+            return None
+
+    def load_record(self, url, markers=None):
+        """
+        """
+        if get_parse_pool().enabled:
+            return self.pool_record(url)
+        if markers and self.plugin.cfg_stream_parse:
+            root = self.stream_url(url, markers)
+        else:
+            root = self.fetch_url(url)
+        if root is None:
+            return None
+        with get_tracer().span("extract"):
+            return extract(root)
+
+    def pool_record(self, url):
+        """
+        Whole page downloaded here and parsed in the parse pool, the page cannot be cut short then
+        """
+        raw = self.download(url)
+        if raw is None:
+            return None
+        try:
+            with get_tracer().span("parse_pool", bytes=len(raw)):
+                record = get_parse_pool().run(parse_book_page, raw, deadline=self.deadline)
+        except Cancelled as e:
+            self.log.info("DK metadata for %r not fetched: %s" % (url, e))
+            return None
+        except:
+            self.log.exception("Error parsing HTML for %r" % url)
+            return None
+        if record is None:
+            self.log.error("URL malformed: %r" % url)
+            self.not_found = True
+            if self.cache is not None:
+                self.cache.invalidate(url)
+        return record
+
+    def fetch_more_info(self, url):
+        """
+        More info fragment, run as a separate executor task
+        """
+        with get_tracer().lookup(self.lookup):
+            return self.fetch_record(url)
+
+    def fetch_url(self, url):
+        """
+        """
+        raw = self.download(url)
+        if raw is None:
+            return None
+        return self.parse_page(url, raw)
 
+    def parse_page(self, url, raw):
+        """
+        """
         # Parse html
         root = None
         try:
-            parser = etree.HTMLParser()
-            root = etree.parse(html, parser)
+            with get_tracer().span("parse_html", bytes=len(raw)):
+                parser = etree.HTMLParser()
+                root = etree.parse(BytesIO(raw), parser)
         except:
             self.log.exception("Error parsing HTML for %r" % url)
+            return None
 
+        return self.check_page(url, root)
+
+    def check_page(self, url, root):
+        """
+        """
         # Check if the html code contains 404 / DK doesn't return HTTP status code 404
-        header_node = root.xpath("//h1/text()")
-        if header_node and (u"<h1>Stránka 404</h1>" in header_node[0]):
+        header_node = extract_header(root)
+        if header_node and (u"Stránka 404" in header_node[0]):
             self.log.error("URL malformed: %r" % url)
+            self.not_found = True
+            if self.cache is not None:
+                self.cache.invalidate(url)
+                self.cache.invalidate(partial_key(url))
             return None
 
         return root
 
-    def fetch_more(self, root):
+    def stream_url(self, url, markers):
+        """
+        Incrementally parse url until all marked fields are complete, the full DOM path is the fallback
+        """
+        if self.cache is not None:
+            # Whole page first, then a page cut short for another set of fields
+            for key in (url, partial_key(url)):
+                raw = self.cache.get(key)
+                if raw is None:
+                    continue
+                parser = IncrementalParser(markers)
+                parser.feed(raw)
+                if parser.done or (key == url and complete_page(raw)):
+                    self.debug("        Cached data for url: %r", key)
+                    return self.check_page(url, parser.close())
+
+        parser = IncrementalParser(markers)
+        chunks = []
+        try:
+            self.debug("        Stream data for url: %r", url)
+            with closing(self.stream(url)) as stream:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    if parser.feed(chunk):
+                        break
+            root = parser.close()
+        except RateLimited as e:
+            self.log.error("DK metadata for %r not fetched: %s" % (url, e))
+            return None
+        except Cancelled as e:
+            self.log.info("DK metadata for %r not fetched: %s" % (url, e))
+            return None
+        except etree.LxmlError:
+            self.log.exception("Incremental parsing failed, using full parse for %r" % url)
+            return self.fetch_url(url)
+        except Exception as e:
+            self.report_error(url, e)
+            return None
+
+        raw = b"".join(chunks)
+        stopped = parser.done and not complete_page(raw)
+        self.debug("        Read %d bytes, stopped early: %s", len(raw), stopped)
+        if self.cache is not None and raw:
+            # Page url holds whole pages only, download() and the parse pool read them as they are
+            self.cache.put(partial_key(url) if stopped else url, raw)
+        return self.check_page(url, root)
+
+    def stream(self, url):
+        """
+        Response body of url in chunks, the connection is closed when the generator is closed
+        """
+        with get_tracer().span("fetch_stream", url=url) as attrs:
+            response = open_response(self.browser, url, self.log, timeout=self.request_timeout(),
+                                     deadline=self.deadline)
+            attrs["bytes"] = 0
+            try:
+                for chunk in read_chunks(response, deadline=self.deadline):
+                    attrs["bytes"] += len(chunk)
+                    yield chunk
+            finally:
+                response.close()
+
+    def request_timeout(self):
+        """
+        Book page and more info fragment are fetched one after another, the page gets half of the budget
+        """
+        return self.deadline.timeout(2 if self.more_url is None and self.plan.more_info else 1)
+
+    def download(self, url):
+        """
+        Return response body for url, from the on-disk cache if possible
+        """
+        if self.cache is not None:
+            raw = self.cache.get(url)
+            # Book page cut short while streaming (cached so by older versions) is fetched again
+            if raw is not None and (book_url(url) is None or complete_page(raw)):
+                self.debug("        Cached data for url: %r", url)
+                return raw
+
+        try:
+            self.debug("        Fetch data for url: %r", url)
+            raw = self.request(url)
+        except RateLimited as e:
+            self.log.error("DK metadata for %r not fetched: %s" % (url, e))
+            return None
+        except Cancelled as e:
+            self.log.info("DK metadata for %r not fetched: %s" % (url, e))
+            return None
+        except Exception as e:
+            self.report_error(url, e)
+            return None
+
+        if self.cache is not None and raw:
+            self.cache.put(url, raw)
+        return raw
+
+    def request(self, url):
+        """
+        Response body of url, through the shared per-host rate limiter
+        """
+        return open_url(self.browser, url, self.log, timeout=self.request_timeout(), deadline=self.deadline)
+
+    def report_error(self, url, e):
+        """
+        """
+        if error_code(e) == 404:
+            self.log.exception("URL malformed: %r" % url)
+            self.not_found = True
+            return
+        attr = getattr(e, "args", [None])
+        attr = attr if attr else [None]
+        if isinstance(attr[0], socket.timeout):
+            self.log.exception("DK metadata for %r timed out. Try again later." % url)
+        else:
+            self.log.exception("Failed to make details query: %r" % url)
+
+    def more_info_url(self, record):
         """
         """
         try:
-            more_info_node = root.xpath("//span[@id='abinfo']/@bid")
-            self.log.info("        Book bid: %s" % more_info_node)
+            more_info_node = record.bid
+            self.debug("        Book bid: %s", more_info_node)
             more_info_url = "https://www.databazeknih.cz/books/book-detail-more-info-ajax.php?bid=" + str(
                 more_info_node[0])
-            self.log.info("        More info url: %r" % more_info_url)
+            self.debug("        More info url: %r", more_info_url)
         except:
             self.log.info("Failed to fetch more info for url: %r" % self.url)
             return None
 
-        return self.fetch_url(more_info_url)
+        return more_info_url
 
-    def parse_details(self, root):
+    def fetch_more(self):
         """
+        Wait for the more info page requested in get_details
         """
+        if not self.more_url:
+            return None
         try:
-            self.log.info("        Parse details: %r" % self.url)
+            if self.more_info_future is None:
+                return self.fetch_more_info(self.more_url)
+            return result_inline(self.more_info_future, self.fetch_more_info, self.more_url)
+        except:
+            self.log.exception("Failed to fetch more info for url: %r" % self.url)
+            return None
+
+    def parse_details(self, record):
+        """
+        Parse the planned fields and emit the result, return it (None when the page is not a book)
+        """
+        try:
+            self.debug("        Parse details: %r", self.url)
             self.databazeknih_id = self.parse_databazeknih_id(self.url)
-            self.log.info("        Parsed DK identifier: %s" % self.databazeknih_id)
+            self.debug("        Parsed DK identifier: %s", self.databazeknih_id)
         except:
             self.log.exception("Error parsing DK identifier for url: %r" % self.url)
             self.databazeknih_id = None
 
         # Parse title
-        self.parse_title(root)
+        self.parse_title(record)
         # Parse authors
-        self.parse_authors(root)
+        self.parse_authors(record)
         if not self.title or not self.authors or not self.databazeknih_id:
             self.log.error("Could not find title/authors/DK id for %r" % self.url)
             self.log.error("DK id: %r Title: %r Authors: %r" % (self.databazeknih_id, self.title, self.authors))
             return
+        if self.plugin.cfg_author_prefetch:
+            self.harvest_authors(record)
 
         mi = Metadata(self.title, self.authors)
         mi.set_identifier("databazeknih", self.databazeknih_id)
 
+        # Only fields of the fetch plan are parsed
         # Parse series
-        self.parse_series(root, mi)
+        if self.plan.wants("series"):
+            self.parse_series(record, mi)
         # Parse comments
-        self.parse_comments(root, mi)
+        if self.plan.wants("comments"):
+            self.parse_comments(record, mi)
         # Parse publisher
-        self.parse_publisher(root, mi)
+        if self.plan.wants("publisher"):
+            self.parse_publisher(record, mi)
         # Parse pubdate
-        self.parse_pubdate(root, mi)
+        if self.plan.wants("pubdate"):
+            self.parse_pubdate(record, mi)
         # Parse tags
-        self.parse_tags(root, mi)
+        if self.plan.wants("tags"):
+            self.parse_tags(record, mi)
         # Parse rating
-        self.parse_rating(root, mi)
-        # Parse book ISBN
-        self.parse_isbn(self.more_info, mi)
+        if self.plan.wants("rating"):
+            self.parse_rating(record, mi)
+        # Parse book ISBN, refresh fetched the more info fragment already
+        if self.more_info is None:
+            self.more_info = self.fetch_more()
+        if self.plan.wants("isbn"):
+            self.parse_isbn(self.more_info, mi)
+        elif self.plan.isbn:
+            mi.isbn = self.isbn = self.plan.isbn
         # Parse language
-        self.parse_language(self.more_info, mi)
+        if self.plan.wants("languages"):
+            self.parse_language(self.more_info, mi)
         # Parse book cover
-        self.parse_cover(root, mi)
+        self.parse_cover(record, mi)
 
         mi.source_relevance = self.relevance
+        if self.query:
+            score = metadata_score(self.query[0], self.query[1], self.title, self.authors)
+            self.debug("        Match score: %.3f", score)
+            mi.source_relevance = round(1 - score, 3)
+            if score >= CONFIDENCE and self.found is not None:
+                self.found.set()
+
+        # Parsed books are resolved from the local catalog next time, without searching
+        self.plugin.catalog_book(mi, self.plan)
 
         self.log.info(mi)
         self.result_queue.put(mi)
+        return mi
 
     def parse_databazeknih_id(self, url):
         """
@@ -188,126 +587,179 @@ class Worker(Thread):
         else:
             return None
 
-    def parse_title(self, root):
+    @traced("parse_title")
+    def parse_title(self, record):
         """
         """
         try:
-            title_node = root.xpath("//h1[@itemprop='name']/text()")
-            self.log.info("        Title node: %s" % title_node)
+            title_node = record.title
+            self.debug("        Title node: %s", title_node)
             self.title = title_node[0].replace("&nbsp;", "").strip()
-            self.log.info("        Parsed book title: %s" % self.title)
+            self.debug("        Parsed book title: %s", self.title)
         except:
             self.log.exception("Error parsing title for url: %r" % self.url)
             self.title = None
 
-    def parse_authors(self, root):
+    @traced("parse_authors")
+    def parse_authors(self, record):
         """
         """
         try:
-            author_nodes = root.xpath("//h2[@class='jmenaautoru']/span[@itemprop='author']/a/text()")
-            self.log.info("        Author nodes: %s" % author_nodes)
+            author_nodes = record.authors
+            self.debug("        Author nodes: %s", author_nodes)
             self.authors = []
             if author_nodes:
                 for author in author_nodes:
-                    self.log.info("        Author: %s" % author)
+                    self.debug("        Author: %s", author)
                     self.authors.append(u"".join(author))
-            self.log.info("        Parsed authors: %s" % self.authors)
+            self.debug("        Parsed authors: %s", self.authors)
         except:
             self.log.exception("Error parsing authors for url: %r" % self.url)
 
-    def parse_series(self, root, mi):
+    def harvest_authors(self, record):
+        """
+        Store all books from the DK pages of the book's authors, so their other books are found without searching.
+        Every author page is fetched once per AUTHOR_MAX_AGE.
+        """
+        bibliography = get_bibliography()
+        for url in record.author_urls:
+            url = author_url(url)
+            if not url or bibliography.fresh(url, AUTHOR_MAX_AGE) or self.deadline.expired():
+                continue
+            try:
+                raw = self.download(url)
+                if not raw:
+                    continue
+                with get_tracer().span("parse_author_page", bytes=len(raw)):
+                    name, books = parse_author_page(raw)
+                self.debug("        Author page %r: %d books", url, len(books))
+                if books:
+                    bibliography.put(url, name, books)
+            except:
+                self.log.exception("Error harvesting author page: %r" % url)
+
+    @traced("parse_series")
+    def parse_series(self, record, mi):
         """
         """
         try:
-            series_node = root.xpath("//em[@class='info']/../a/text()")
-            series_index_node = root.xpath("//em[@class='info']/text()")
-            self.log.info("        Series node: %s" % series_node)
-            self.log.info("        Series index node: %s" % series_index_node)
+            series_node = record.series
+            series_index_node = record.series_index
+            self.debug("        Series node: %s", series_node)
+            self.debug("        Series index node: %s", series_index_node)
 
             if series_node:
-                series_url = root.xpath("//em[@class='info']/../a/@href")
-                self.log.info("        Series url node: %s" % series_url)
+                series_url = record.series_url
+                self.debug("        Series url node: %s", series_url)
                 if ("serie" in series_url[0]) and series_index_node:
                     index = re.search("(\d*)\.", series_index_node[0]).groups("0")[0]
-                    self.log.info("        Series index: %s" % index)
+                    self.debug("        Series index: %s", index)
                     try:
                         index = float(index)
                     except:
                         index = None
+                    if self.plugin.cfg_series_prefetch:
+                        volume = self.series_volume(series_url[0])
+                        self.debug("        Series page volume: %s", volume)
+                        if volume and volume[1] is not None:
+                            index = volume[1]
                     mi.series = self.series = series_node[0]
                     mi.series_index = self.series_index = index
-            self.log.info("        Parsed series: %s" % self.series)
-            self.log.info("        Parsed series index: %s" % self.series_index)
+            self.debug("        Parsed series: %s", self.series)
+            self.debug("        Parsed series index: %s", self.series_index)
         except:
             self.log.exception("Error parsing series for url: %r" % self.url)
 
-    def parse_comments(self, root, mi):
+    def series_volume(self, url):
+        """
+        (series name, series index) of this book from the DK series page, the page is fetched once per series
+        and its volumes are stored, so the other volumes are found without searching
+        """
+        url = series_url(url)
+        if not url or not self.databazeknih_id:
+            return None
+        index = get_series_index()
+        if not index.fresh(url, SERIES_MAX_AGE):
+            raw = self.download(url)
+            if raw:
+                with get_tracer().span("parse_series_page", bytes=len(raw)):
+                    name, volumes = parse_series_page(raw)
+                if volumes:
+                    index.put(url, name, volumes)
+        return index.volume(self.databazeknih_id)
+
+    @traced("parse_comments")
+    def parse_comments(self, record, mi):
         """
         """
         try:
-            comments_node = root.xpath("//p[@itemprop='description']/span/text()")
-            if not comments_node:
-                comments_node = root.xpath("//p[@itemprop='description']/text()")
-            self.log.info("        Comments node: %s" % comments_node)
+            comments_node = record.comments
+            self.debug("        Comments node: %s", comments_node)
 
-            if comments_node:
+            if record.comments_html is not None:
+                mi.comments = self.comments = record.comments_html
+            elif comments_node:
                 mi.comments = self.comments = comments_to_html("\r\n".join(comments_node))
-            self.log.info("        Parsed comments: %s" % mi.comments)
+            self.debug("        Parsed comments: %s", mi.comments)
         except:
             self.log.exception("Error parsing comments for url: %r" % self.url)
 
-    def parse_publisher(self, root, mi):
+    @traced("parse_publisher")
+    def parse_publisher(self, record, mi):
         """
         """
         try:
-            publisher_node = root.xpath("//span[@itemprop='publisher']/a/text()")
-            self.log.info("        Publisher node: %s" % publisher_node)
+            publisher_node = record.publisher
+            self.debug("        Publisher node: %s", publisher_node)
 
             if publisher_node:
                 mi.publisher = self.publisher = publisher_node[0].strip()
-            self.log.info("        Parsed publisher: %s" % mi.publisher)
+            self.debug("        Parsed publisher: %s", mi.publisher)
         except:
             self.log.exception("Error parsing publisher for url: %r" % self.url)
 
-    def parse_pubdate(self, root, mi):
+    @traced("parse_pubdate")
+    def parse_pubdate(self, record, mi):
         """
         """
         try:
-            datepublished_node = root.xpath("//span[@itemprop='datePublished']/text()")
-            self.log.info("        DatePublished node: %s" % datepublished_node)
+            datepublished_node = record.pubdate
+            self.debug("        DatePublished node: %s", datepublished_node)
 
             if datepublished_node:
                 mi.pubdate = self.pubdate = parse_date(datepublished_node[0], assume_utc=True)
-            self.log.info("        Parsed pubdate: %s" % mi.pubdate)
+            self.debug("        Parsed pubdate: %s", mi.pubdate)
         except:
             self.log.exception("Error parsing pubdate for url: %r" % self.url)
 
-    def parse_tags(self, root, mi):
+    @traced("parse_tags")
+    def parse_tags(self, record, mi):
         """
         """
         try:
-            tag_nodes = root.xpath("//h5[@itemprop='genre']/a/text()")
-            self.log.info("        Tag nodes: %s" % tag_nodes)
+            tag_nodes = record.tags
+            self.debug("        Tag nodes: %s", tag_nodes)
 
             if tag_nodes:
                 for tag in tag_nodes:
                     self.tags.append(u"".join(tag))
             mi.tags = self.tags
-            self.log.info("        Parsed tags: %s" % mi.tags)
+            self.debug("        Parsed tags: %s", mi.tags)
         except:
             self.log.exception("Error parsing tags for url: %r" % self.url)
 
-    def parse_rating(self, root, mi):
+    @traced("parse_rating")
+    def parse_rating(self, record, mi):
         """
         """
         try:
-            rating_node = root.xpath("//a[@class='bpoints']/div/text()")
-            self.log.info("        Rating node: %s" % rating_node)
+            rating_node = record.rating
+            self.debug("        Rating node: %s", rating_node)
 
             if rating_node:
                 rating_node = rating_node[0].strip("%")
                 rating_node = float(rating_node)
-                self.log.info("        Rating_num: %s" % rating_node)
+                self.debug("        Rating_num: %s", rating_node)
 
                 if rating_node:
                     if rating_node >= 80:
@@ -322,51 +774,54 @@ class Worker(Thread):
                         self.rating = 1
 
             mi.rating = self.rating
-            self.log.info("        Parsed rating: %s" % mi.rating)
+            self.debug("        Parsed rating: %s", mi.rating)
         except:
             self.log.exception("Error parsing rating for url: %r" % self.url)
 
-    def parse_isbn(self, root, mi):
+    @traced("parse_isbn")
+    def parse_isbn(self, record, mi):
         """
         """
         try:
             if self.more_info:
-                isbn_node = root.xpath("//span[@itemprop='isbn']/text()")
-                self.log.info("        ISBN node: %s" % isbn_node)
+                isbn_node = record.isbn
+                self.debug("        ISBN node: %s", isbn_node)
                 if isbn_node:
                     self.isbn = check_isbn(isbn_node[0])
-                self.log.info("        ISBN: %s" % self.isbn)
+                self.debug("        ISBN: %s", self.isbn)
                 if self.isbn and self.databazeknih_id:
                     mi.isbn = self.isbn
                     self.plugin.cache_isbn_to_identifier(self.isbn, self.databazeknih_id)
         except:
             self.log.exception("Error parsing ISBN for url: %r" % self.url)
 
-    def parse_language(self, root, mi):
+    @traced("parse_language")
+    def parse_language(self, record, mi):
         """
         """
         try:
             if self.more_info:
-                language_node = root.xpath("//span[@itemprop='language']/text()")
-                self.log.info("        Language node: %s" % language_node)
+                language_node = record.language
+                self.debug("        Language node: %s", language_node)
                 if language_node:
                     language = u"".join(language_node[0])
                     self.languages.append(self.lang_map.get(language, "ces"))
-                self.log.info("        Language: %s" % ",".join(self.languages))
+                self.debug("        Language: %s", ",".join(self.languages))
                 mi.languages = self.languages
         except:
             self.log.exception("Error parsing languages for url: %r" % self.url)
 
-    def parse_cover(self, root, mi):
+    @traced("parse_cover")
+    def parse_cover(self, record, mi):
         """
         """
         try:
-            cover_url_node = root.xpath("//*[@id='icover_mid']//img[@class='kniha_img']/@src")
-            self.log.info("        Cover url node: %s" % cover_url_node)
+            cover_url_node = record.cover
+            self.debug("        Cover url node: %s", cover_url_node)
             if cover_url_node:
                 self.cover_url = cover_url_node[0]
                 self.plugin.cache_identifier_to_cover_url(self.databazeknih_id, self.cover_url)
-                self.log.info("        Parsed URL for cover: %r" % self.cover_url)
+                self.debug("        Parsed URL for cover: %r", self.cover_url)
             mi.has_cover = bool(self.cover_url)
         except:
             self.log.exception("Error parsing cover for url: %r" % self.url)